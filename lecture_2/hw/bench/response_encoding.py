@@ -0,0 +1,100 @@
+"""Requests per second of the listing and lookup endpoints, in process over ASGI.
+
+Each endpoint is timed as served (entities encoded straight to cached JSON bytes)
+and through a baseline route that returns Pydantic models, so FastAPI validates
+and re-serialises them with `response_model` as it did before. The listing response
+cache is cleared before every request, so each page is loaded and encoded rather
+than served whole from that cache:
+
+    python -m lecture_2.hw.bench.response_encoding --items 1000 --requests 2000
+"""
+
+import argparse
+import asyncio
+import time
+from typing import List
+
+import httpx
+from fastapi import FastAPI
+
+from lecture_2.hw.shop_api.models.cart_models import Cart
+from lecture_2.hw.shop_api.models.item_models import Item
+from lecture_2.hw.shop_api.response_cache import carts_cache, items_cache
+from lecture_2.hw.shop_api.routers.cart_routers import router_cart
+from lecture_2.hw.shop_api.routers.item_routers import router_item
+from lecture_2.hw.shop_api.storage import ItemInfo, MemoryStorage, get_cart, get_carts, get_item, get_items, set_storage
+
+
+def create_app() -> FastAPI:
+    app = FastAPI()
+    app.include_router(router_cart)
+    app.include_router(router_item)
+
+    @app.get('/baseline/item/', response_model=List[Item])
+    async def baseline_items(limit: int = 10) -> List[Item]:
+        return [Item.from_entity(item) for item in get_items(0, limit, None, None, False)]
+
+    @app.get('/baseline/item/{id}', response_model=Item)
+    async def baseline_item(id: int) -> Item:
+        return Item.from_entity(get_item(id))
+
+    @app.get('/baseline/cart/', response_model=List[Cart])
+    async def baseline_carts(limit: int = 10) -> List[Cart]:
+        return [Cart.from_entity(cart) for cart in get_carts(0, limit, None, None, None, None)]
+
+    @app.get('/baseline/cart/{id}', response_model=Cart)
+    async def baseline_cart(id: int) -> Cart:
+        return Cart.from_entity(get_cart(id))
+
+    return app
+
+
+def fill(items: int, carts: int, lines: int) -> None:
+    storage = MemoryStorage()
+    ids = [item.id for item in storage.create_items([ItemInfo(name=f'item {i}', price=float(i)) for i in range(items)])]
+    for i in range(carts):
+        cart = storage.create_cart()
+        storage.add_items_to_cart(cart.id, [(ids[(i + j) % items], 1) for j in range(lines)])
+    set_storage(storage)
+
+
+async def rate(client: httpx.AsyncClient, url: str, requests: int) -> float:
+    await client.get(url)
+    start = time.perf_counter()
+    for _ in range(requests):
+        items_cache.clear()
+        carts_cache.clear()
+        response = await client.get(url)
+        response.raise_for_status()
+    return requests / (time.perf_counter() - start)
+
+
+async def run(args: argparse.Namespace) -> None:
+    fill(args.items, args.carts, args.lines)
+    transport = httpx.ASGITransport(app=create_app())
+    endpoints = [
+        f'/item/?limit={args.limit}',
+        '/item/0',
+        f'/cart/?limit={args.limit}',
+        '/cart/0',
+    ]
+    print(f"{'endpoint':>24} {'baseline, req/s':>16} {'encoded, req/s':>15} {'speedup':>8}")
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        for url in endpoints:
+            baseline = await rate(client, '/baseline' + url, args.requests)
+            encoded = await rate(client, url, args.requests)
+            print(f'{url:>24} {baseline:>16,.0f} {encoded:>15,.0f} {encoded / baseline:>7.2f}x')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--carts', type=int, default=200)
+    parser.add_argument('--lines', type=int, default=10, help='lines per cart')
+    parser.add_argument('--limit', type=int, default=100, help='page size of the listings')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per endpoint')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+"""Load test of the shop API, with results kept as JSON for regression comparison.
+
+Seeds a catalog of `--items` items and `--carts` carts over HTTP, then runs each
+scenario with `--concurrency` clients making `--requests` requests each, and reports
+throughput and latency percentiles per scenario. The app runs in process over ASGI
+(`--target asgi`, a fresh store from the SHOP_* environment) or in a local uvicorn
+started for the run (`--target uvicorn`, which also passes the environment on):
+
+    python -m lecture_2.hw.bench.shop_load --items 100000 --output before.json
+    python -m lecture_2.hw.bench.shop_load --items 100000 --baseline before.json --max-regression 0.1
+
+With `--baseline`, each scenario is compared with the same scenario in an earlier
+result; `--max-regression` makes the run fail if any throughput dropped by more
+than that fraction.
+
+Scenarios:
+  item_crud         create, read, patch and delete an item (four requests)
+  item_get          read a random catalog item
+  filtered_listing  list items in a random price window, or by a name prefix
+  cart_add          add a random item to a random cart
+  deep_offset       list a page at a random offset in the second half of the catalog
+  cursor_walk       follow the Link header through the whole catalog, page by page
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, List, Optional
+
+import httpx
+
+PAGE = 50
+
+
+class Context:
+    """What a client needs to run a scenario: the catalog, its random source and its own state."""
+
+    def __init__(self, client: httpx.AsyncClient, items: List[int], carts: List[int], seed: int) -> None:
+        self.client = client
+        self.items = items
+        self.carts = carts
+        self.random = random.Random(seed)
+        self.latencies = list[float]()
+        self.errors = 0
+        self.next_page: Optional[str] = None
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        start = time.perf_counter()
+        response = await self.client.request(method, url, **kwargs)
+        self.latencies.append(time.perf_counter() - start)
+        if response.is_error:
+            self.errors += 1
+        return response
+
+
+async def item_crud(ctx: Context) -> None:
+    price = ctx.random.uniform(0, 1000)
+    response = await ctx.request('POST', '/item/', json={'name': 'bench item', 'price': price})
+    id = response.json()['id']
+    await ctx.request('GET', f'/item/{id}')
+    await ctx.request('PATCH', f'/item/{id}', json={'price': price + 1})
+    await ctx.request('DELETE', f'/item/{id}')
+
+
+async def item_get(ctx: Context) -> None:
+    await ctx.request('GET', f'/item/{ctx.random.choice(ctx.items)}')
+
+
+async def filtered_listing(ctx: Context) -> None:
+    if ctx.random.random() < 0.25:
+        await ctx.request('GET', '/item/', params={'q': f'item {ctx.random.randrange(100)}', 'limit': 20})
+        return
+    low = ctx.random.uniform(0, 990)
+    await ctx.request('GET', '/item/', params={'min_price': low, 'max_price': low + 10, 'limit': 20})
+
+
+async def cart_add(ctx: Context) -> None:
+    await ctx.request('POST', f'/cart/{ctx.random.choice(ctx.carts)}/add/{ctx.random.choice(ctx.items)}')
+
+
+async def deep_offset(ctx: Context) -> None:
+    offset = ctx.random.randrange(len(ctx.items) // 2, max(len(ctx.items) - PAGE, len(ctx.items) // 2 + 1))
+    await ctx.request('GET', '/item/', params={'offset': offset, 'limit': PAGE})
+
+
+async def cursor_walk(ctx: Context) -> None:
+    response = await ctx.request('GET', ctx.next_page or f'/item/?limit={PAGE}')
+    ctx.next_page = response.links.get('next', {}).get('url')
+
+
+SCENARIOS: dict[str, Callable[[Context], Awaitable[None]]] = {
+    'item_crud': item_crud,
+    'item_get': item_get,
+    'filtered_listing': filtered_listing,
+    'cart_add': cart_add,
+    'deep_offset': deep_offset,
+    'cursor_walk': cursor_walk,
+}
+
+
+async def seed(client: httpx.AsyncClient, items: int, carts: int, concurrency: int) -> tuple[List[int], List[int]]:
+    # prices repeat every 1000 items, so a price window matches a fixed share of any catalog
+    item_ids = []
+    for first in range(0, items, 1000):
+        batch = [{'name': f'item {i}', 'price': float(i % 1000) + 0.5} for i in range(first, min(first + 1000, items))]
+        response = await client.post('/item/batch', json=batch)
+        response.raise_for_status()
+        item_ids.extend(item['id'] for item in response.json())
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def create_cart(i: int) -> int:
+        async with semaphore:
+            response = await client.post('/cart/')
+            response.raise_for_status()
+            id = response.json()['id']
+            lines = [{'item_id': item_ids[(i + j) % len(item_ids)], 'quantity': 1} for j in range(5)]
+            (await client.post(f'/cart/{id}/add', json=lines)).raise_for_status()
+            return id
+
+    return item_ids, list(await asyncio.gather(*(create_cart(i) for i in range(carts))))
+
+
+def percentile(latencies: List[float], p: float) -> float:
+    # nearest rank on sorted latencies
+    return latencies[min(len(latencies) - 1, max(0, round(p / 100 * len(latencies)) - 1))]
+
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    scenario: Callable[[Context], Awaitable[None]],
+    items: List[int],
+    carts: List[int],
+    args: argparse.Namespace) -> dict:
+    contexts = [Context(client, items, carts, args.seed + i) for i in range(args.concurrency)]
+    for _ in range(args.warmup):
+        await asyncio.gather(*(scenario(ctx) for ctx in contexts))
+    for ctx in contexts:
+        ctx.latencies.clear()
+        ctx.errors = 0
+
+    async def client_loop(ctx: Context) -> None:
+        for _ in range(args.requests):
+            await scenario(ctx)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client_loop(ctx) for ctx in contexts))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for ctx in contexts for latency in ctx.latencies)
+    return {
+        'requests': len(latencies),
+        'errors': sum(ctx.errors for ctx in contexts),
+        'seconds': round(elapsed, 3),
+        'throughput': round(len(latencies) / elapsed, 1),
+        **{f'p{p}_ms': round(percentile(latencies, p) * 1000, 3) for p in (50, 90, 99)},
+        'max_ms': round(latencies[-1] * 1000, 3),
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def wait_ready(client: httpx.AsyncClient, server: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'uvicorn exited with code {server.returncode}')
+        try:
+            (await client.get('/item/', params={'limit': 1})).raise_for_status()
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError('uvicorn did not start in time')
+
+
+def asgi_client() -> httpx.AsyncClient:
+    from lecture_2.hw.shop_api.main import app
+    from lecture_2.hw.shop_api.response_cache import carts_cache, items_cache
+    from lecture_2.hw.shop_api.storage import create_storage, set_storage
+
+    set_storage(create_storage())
+    items_cache.clear()
+    carts_cache.clear()
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://bench')
+
+
+async def run(args: argparse.Namespace) -> dict:
+    server = None
+    if args.target == 'uvicorn':
+        port = free_port()
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'lecture_2.hw.shop_api.main:app',
+             '--port', str(port), '--workers', str(args.workers), '--log-level', 'warning'])
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        client = httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}', limits=limits)
+    else:
+        client = asgi_client()
+
+    try:
+        async with client:
+            if server is not None:
+                await wait_ready(client, server)
+            start = time.perf_counter()
+            items, carts = await seed(client, args.items, args.carts, args.concurrency)
+            print(f'seeded {len(items):,} items and {len(carts):,} carts in {time.perf_counter() - start:.1f}s')
+
+            print(f"{'scenario':>17} {'req/s':>9} {'p50, ms':>8} {'p90, ms':>8} {'p99, ms':>8} {'max, ms':>8} {'errors':>6}")
+            scenarios = {}
+            for name in args.scenarios:
+                scenarios[name] = result = await run_scenario(client, SCENARIOS[name], items, carts, args)
+                print(f"{name:>17} {result['throughput']:>9,.0f} {result['p50_ms']:>8.2f} {result['p90_ms']:>8.2f} "
+                      f"{result['p99_ms']:>8.2f} {result['max_ms']:>8.2f} {result['errors']:>6}")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    return {
+        'meta': {
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'target': args.target,
+            'workers': args.workers if args.target == 'uvicorn' else None,
+            'storage': os.environ.get('SHOP_STORAGE', 'memory'),
+            'items': args.items,
+            'carts': args.carts,
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'seed': args.seed,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+        },
+        'scenarios': scenarios,
+    }
+
+
+def compare(result: dict, baseline: dict, max_regression: Optional[float]) -> bool:
+    """Print each scenario against the baseline; False if a throughput dropped by more than `max_regression`."""
+    ok = True
+    for key in ('target', 'workers', 'storage', 'items', 'carts', 'concurrency'):
+        if result['meta'][key] != baseline['meta'].get(key):
+            print(f"note: {key} differs from the baseline ({baseline['meta'].get(key)} there, {result['meta'][key]} now)")
+    print(f"{'scenario':>17} {'req/s':>9} {'baseline':>9} {'change':>8} {'p99 change':>11}")
+    for name, current in result['scenarios'].items():
+        previous = baseline['scenarios'].get(name)
+        if previous is None:
+            continue
+        change = current['throughput'] / previous['throughput'] - 1
+        p99_change = current['p99_ms'] / previous['p99_ms'] - 1
+        regressed = max_regression is not None and change < -max_regression
+        ok = ok and not regressed
+        print(f"{name:>17} {current['throughput']:>9,.0f} {previous['throughput']:>9,.0f} {change:>+8.1%} "
+              f"{p99_change:>+11.1%}{'  REGRESSION' if regressed else ''}")
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', choices=['asgi', 'uvicorn'], default='asgi')
+    parser.add_argument('--workers', type=int, default=1, help='uvicorn workers; more than one needs SHOP_STORAGE=sqlite')
+    parser.add_argument('--items', type=int, default=10_000, help='catalog size')
+    parser.add_argument('--carts', type=int, default=1_000)
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent clients')
+    parser.add_argument('--requests', type=int, default=200, help='scenario runs per client')
+    parser.add_argument('--warmup', type=int, default=5, help='scenario runs per client before measuring')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare with the results in this JSON file')
+    parser.add_argument('--max-regression', type=float, help='fail if a throughput dropped by more than this fraction')
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(result, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            if not compare(result, json.load(file), args.max_regression):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Throughput of concurrent add_item_to_cart calls on distinct carts.
+
+Compares the memory backend with its default lock striping against a single
+stripe, which makes every item and cart share one lock. Each thread adds to its
+own share of `--carts` carts, so the cart price and quantity indexes are as large
+as in a store with that many carts:
+
+    python -m lecture_2.hw.bench.storage_concurrency --threads 1 2 4 8
+    python -m lecture_2.hw.bench.storage_concurrency --threads 1 2 4 8 --journal
+
+With the GIL enabled threads cannot run Python code in parallel, so adds that only
+touch memory run at the same rate on any number of threads; the difference between
+the variants shows on a free-threaded build with several cores. With `--journal`
+every add also waits for its record to be on disk, with no lock held, and threads
+waiting together share one fsync, so throughput grows with the number of threads.
+"""
+
+import argparse
+import sys
+import tempfile
+import threading
+import time
+
+from lecture_2.hw.shop_api.storage import ItemInfo, MemoryStorage
+
+
+def run(threads: int, ops: int, lock_stripes: int, carts: int, journal: bool) -> float:
+    with tempfile.TemporaryDirectory(prefix="shop-concurrency-") as directory:
+        if journal:
+            storage = MemoryStorage.recover(directory, lock_stripes=lock_stripes)
+        else:
+            storage = MemoryStorage(lock_stripes=lock_stripes)
+        items = storage.create_items([ItemInfo(name=f"item {i}", price=1.0 + i) for i in range(100)])
+        cart_ids = [storage.create_cart().id for _ in range(max(carts, threads))]
+        barrier = threading.Barrier(threads + 1)
+
+        def worker(shard: list[int]) -> None:
+            barrier.wait()
+            for i in range(ops):
+                storage.add_item_to_cart(shard[i % len(shard)], items[i % len(items)].id)
+
+        workers = [threading.Thread(target=worker, args=(cart_ids[k::threads],)) for k in range(threads)]
+        for thread in workers:
+            thread.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        storage.close()
+        return threads * ops / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--ops", type=int, default=20000, help="adds per thread")
+    parser.add_argument("--stripes", type=int, default=64)
+    parser.add_argument("--carts", type=int, default=10_000, help="carts the adds are spread over")
+    parser.add_argument("--journal", action="store_true", help="log every add and wait for it to be on disk")
+    args = parser.parse_args()
+
+    gil = getattr(sys, "_is_gil_enabled", lambda: True)()
+    print(f"python {sys.version.split()[0]}, GIL {'enabled' if gil else 'disabled'}")
+    print(f"{'threads':>7} {'1 lock, ops/s':>15} {f'{args.stripes} stripes, ops/s':>18}")
+    for threads in args.threads:
+        single = run(threads, args.ops, 1, args.carts, args.journal)
+        striped = run(threads, args.ops, args.stripes, args.carts, args.journal)
+        print(f"{threads:>7} {single:>15,.0f} {striped:>18,.0f}")
+
+
+if __name__ == "__main__":
+    main()
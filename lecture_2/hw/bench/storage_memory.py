@@ -0,0 +1,56 @@
+"""Memory held per stored item, extrapolated to a million items.
+
+Measures with tracemalloc the bare records (the Pydantic `Item` model against
+the slotted `ItemEntity` dataclass) and a whole memory backend, which adds the
+id dict and the sorted price index on top of the records:
+
+    python -m lecture_2.hw.bench.storage_memory --items 100000
+"""
+
+import argparse
+import gc
+import tracemalloc
+from typing import Callable
+
+from lecture_2.hw.shop_api.models.item_models import Item
+from lecture_2.hw.shop_api.storage import ItemEntity, ItemInfo, MemoryStorage
+
+
+def measure(build: Callable[[], object]) -> int:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        kept = build()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del kept
+    return size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=100000)
+    args = parser.parse_args()
+    n = args.items
+    # names are built up front, so only the records themselves are traced
+    names = [f"item {i}" for i in range(n)]
+
+    def store() -> MemoryStorage:
+        storage = MemoryStorage()
+        storage.create_items([ItemInfo(name=name, price=float(i)) for i, name in enumerate(names)])
+        return storage
+
+    variants = {
+        "pydantic Item": lambda: [Item(id=i, name=name, price=float(i)) for i, name in enumerate(names)],
+        "ItemEntity": lambda: [ItemEntity(id=i, name=name, price=float(i)) for i, name in enumerate(names)],
+        "MemoryStorage": store,
+    }
+    print(f"{'records':>14} {'bytes/item':>11} {'MiB per 1M items':>17}")
+    for label, build in variants.items():
+        per_item = measure(build) / n
+        print(f"{label:>14} {per_item:>11,.0f} {per_item * 1_000_000 / 2**20:>17,.1f}")
+
+
+if __name__ == "__main__":
+    main()
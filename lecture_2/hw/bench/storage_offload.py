@@ -0,0 +1,124 @@
+"""Latency under concurrency with a blocking backend, calls inline vs offloaded to threads.
+
+The store is SQLite with a fixed delay added to every call, standing in for a
+disk- or network-backed store. Concurrent clients request items and add them to
+carts in process over ASGI, while a heartbeat task on the same event loop measures
+how late its 1 ms sleeps wake up. With inline calls every storage call stalls the
+loop: each client's requests run back to back while the others cannot even start,
+so request latency looks low while throughput and the heartbeat collapse:
+
+    python -m lecture_2.hw.bench.storage_offload --clients 16 --delay 0.01 --threads 8
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from typing import List, Optional
+
+import httpx
+from fastapi import FastAPI
+
+from lecture_2.hw.shop_api.routers.cart_routers import router_cart
+from lecture_2.hw.shop_api.routers.item_routers import router_item
+from lecture_2.hw.shop_api.storage import CartEntity, ItemEntity, ItemInfo, SQLiteStorage, set_storage
+from lecture_2.hw.shop_api.storage.aio import set_offload_threads
+
+
+class SlowStorage(SQLiteStorage):
+    """SQLite with `delay` seconds added to the calls the benchmark makes."""
+
+    def __init__(self, path: str, delay: float) -> None:
+        super().__init__(path)
+        self._delay = delay
+
+    def get_item_generation(self) -> int:
+        time.sleep(self._delay)
+        return super().get_item_generation()
+
+    def get_cart_generation(self) -> int:
+        time.sleep(self._delay)
+        return super().get_cart_generation()
+
+    def get_item_version(self, id: int) -> Optional[int]:
+        time.sleep(self._delay)
+        return super().get_item_version(id)
+
+    def get_item(self, id: int) -> Optional[ItemEntity]:
+        time.sleep(self._delay)
+        return super().get_item(id)
+
+    def add_items_to_cart(self, cart_id: int, lines: List[tuple[int, int]]) -> CartEntity:
+        time.sleep(self._delay)
+        return super().add_items_to_cart(cart_id, lines)
+
+
+def percentile(values: List[float], p: int) -> float:
+    return statistics.quantiles(values, n=100, method='inclusive')[p - 1] if len(values) > 1 else values[0]
+
+
+async def heartbeat(lags: List[float], stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - start - 0.001)
+
+
+async def client_loop(client: httpx.AsyncClient, items: List[ItemEntity], cart: int, requests: int, latencies: List[float]) -> None:
+    for i in range(requests):
+        item = items[i % len(items)]
+        start = time.perf_counter()
+        if i % 4 == 3:
+            response = await client.post(f'/cart/{cart}/add/{item.id}')
+        else:
+            response = await client.get(f'/item/{item.id}')
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+
+
+async def run(args: argparse.Namespace, threads: int) -> None:
+    set_offload_threads(threads)
+    with tempfile.TemporaryDirectory(prefix='shop-offload-') as directory:
+        await measure(args, threads, SlowStorage(os.path.join(directory, 'shop.db'), args.delay))
+
+
+async def measure(args: argparse.Namespace, threads: int, storage: SlowStorage) -> None:
+    items = storage.create_items([ItemInfo(name=f'item {i}', price=float(i)) for i in range(100)])
+    carts = [storage.create_cart().id for _ in range(args.clients)]
+    set_storage(storage)
+
+    app = FastAPI()
+    app.include_router(router_cart)
+    app.include_router(router_item)
+    latencies, lags, stop = list[float](), list[float](), asyncio.Event()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://bench') as client:
+        beat = asyncio.create_task(heartbeat(lags, stop))
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(client, items, cart, args.requests, latencies) for cart in carts))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await beat
+
+    ms = 1000
+    print(f'{threads or "inline":>8} {len(latencies) / elapsed:>8,.0f} '
+          f'{percentile(latencies, 50) * ms:>8.1f} {percentile(latencies, 99) * ms:>8.1f} '
+          f'{percentile(lags, 99) * ms:>9.2f} {max(lags) * ms:>9.2f}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=16, help='concurrent clients')
+    parser.add_argument('--requests', type=int, default=20, help='requests per client')
+    parser.add_argument('--delay', type=float, default=0.01, help='seconds added to each storage call')
+    parser.add_argument('--threads', type=int, default=8, help='size of the offload pool')
+    args = parser.parse_args()
+
+    print(f"{'threads':>8} {'req/s':>8} {'p50, ms':>8} {'p99, ms':>8} {'lag p99':>9} {'lag max':>9}")
+    for threads in [0, args.threads]:
+        asyncio.run(run(args, threads))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Cost of persisting the memory backend, and how long it takes to come back.
+
+Fills a journaled store with items in batches and with carts, measures write
+throughput of concurrent single adds (each waits for its group commit), the
+pause of a snapshot, and recovery from the snapshot plus the log written after it:
+
+    python -m lecture_2.hw.bench.storage_recovery --items 1000000 --dir /tmp/shop-data
+"""
+
+import argparse
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from lecture_2.hw.shop_api.storage import ItemInfo, MemoryStorage
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=1_000_000)
+    parser.add_argument("--carts", type=int, default=10_000)
+    parser.add_argument("--adds", type=int, default=20_000, help="adds to carts after the snapshot")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--dir", help="data directory, a temporary one by default")
+    args = parser.parse_args()
+    directory = args.dir or tempfile.mkdtemp(prefix="shop-data-")
+
+    storage = MemoryStorage.recover(directory)
+    start = time.perf_counter()
+    for first in range(0, args.items, 10_000):
+        storage.create_items([ItemInfo(name=f"item {i}", price=float(i % 1000)) for i in range(first, first + 10_000)])
+    carts = [storage.create_cart().id for _ in range(args.carts)]
+    print(f"filled {args.items:,} items, {args.carts:,} carts in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    storage.snapshot()
+    print(f"snapshot: {time.perf_counter() - start:.2f}s")
+
+    def add(i: int) -> None:
+        storage.add_item_to_cart(carts[i % len(carts)], i % args.items)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as executor:
+        list(executor.map(add, range(args.adds)))
+    elapsed = time.perf_counter() - start
+    print(f"{args.adds:,} durable adds on {args.threads} threads: {args.adds / elapsed:,.0f} ops/s")
+    storage.close()
+
+    start = time.perf_counter()
+    recovered = MemoryStorage.recover(directory)
+    print(f"recovery: {time.perf_counter() - start:.2f}s")
+    recovered.close()
+
+    if args.dir is None:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
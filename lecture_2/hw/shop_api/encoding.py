@@ -0,0 +1,63 @@
+from collections import OrderedDict
+from typing import Callable, Generic, Iterable, Optional, TypeVar
+from fastapi.responses import Response
+from pydantic_core import to_json
+from .storage import CartEntity, ItemEntity, get_storage
+
+Entity = TypeVar('Entity', ItemEntity, CartEntity)
+
+
+def _item_fields(item: ItemEntity) -> dict:
+    # keys in the order of the Item model, so the bytes match its model_dump_json()
+    return {'id': item.id, 'name': item.name, 'price': item.price, 'deleted': item.deleted}
+
+def _cart_fields(cart: CartEntity) -> dict:
+    return {
+        'id': cart.id,
+        'items': [
+            {'id': line.id, 'name': line.name, 'quantity': line.quantity, 'available': line.available}
+            for line in cart.items
+        ],
+        'price': cart.price,
+    }
+
+
+class EncodedCache(Generic[Entity]):
+    """JSON bytes of entities, reused until the entity's version changes.
+
+    Keyed by store epoch and id; the least recently used entries are dropped past `maxsize`.
+    """
+
+    def __init__(self, fields: Callable[[Entity], dict], maxsize: int = 100_000) -> None:
+        self._fields = fields
+        self._maxsize = maxsize
+        self._encoded = OrderedDict[tuple[str, int], tuple[int, bytes]]()
+
+    def __call__(self, entity: Entity) -> bytes:
+        key = (get_storage().epoch, entity.id)
+        cached = self._encoded.get(key)
+        if cached is not None and cached[0] == entity.version:
+            self._encoded.move_to_end(key)
+            return cached[1]
+
+        encoded = to_json(self._fields(entity))
+        self._encoded[key] = (entity.version, encoded)
+        self._encoded.move_to_end(key)
+        if len(self._encoded) > self._maxsize:
+            self._encoded.popitem(last=False)
+        return encoded
+
+    def clear(self) -> None:
+        self._encoded.clear()
+
+
+encode_item = EncodedCache(_item_fields)
+encode_cart = EncodedCache(_cart_fields)
+
+
+def json_array(encoded: Iterable[bytes]) -> bytes:
+    return b'[' + b','.join(encoded) + b']'
+
+def json_response(content: bytes, headers: Optional[dict[str, str]] = None) -> Response:
+    """A response with already encoded JSON, skipping FastAPI's validation and re-encoding."""
+    return Response(content=content, media_type='application/json', headers=headers)
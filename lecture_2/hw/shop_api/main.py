@@ -1,11 +1,31 @@
-from fastapi import FastAPI
+import math
+import os
+from http import HTTPStatus
+from fastapi import FastAPI, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse
+from .routers.admin_routers import router_admin
 from .routers.item_routers import router_item
 from .routers.cart_routers import router_cart
 from prometheus_fastapi_instrumentator import Instrumentator
 
 app = FastAPI(title="Shop API")
 
+
+@app.exception_handler(RequestValidationError)
+async def validation_exception_handler(request: Request, exc: RequestValidationError) -> JSONResponse:
+    # as FastAPI's own handler, but a rejected NaN or infinite input is echoed as a string,
+    # as JSON has no literal for it
+    errors = jsonable_encoder(exc.errors(), custom_encoder={float: lambda v: v if math.isfinite(v) else str(v)})
+    return JSONResponse({'detail': errors}, status_code=HTTPStatus.UNPROCESSABLE_ENTITY)
+
+
 Instrumentator().instrument(app).expose(app)
 
 app.include_router(router_cart)
 app.include_router(router_item)
+
+# the profiler exposes the process's code paths, so it is only served when enabled explicitly
+if os.environ.get('SHOP_PROFILING') == '1':
+    app.include_router(router_admin)
@@ -1,5 +1,8 @@
-from pydantic import BaseModel
+from __future__ import annotations
+
+from pydantic import BaseModel, PositiveInt
 from typing import List
+from ..storage.entities import CartEntity
 
 
 class CartItem(BaseModel):
@@ -13,5 +16,17 @@ class Cart(BaseModel):
     items: List[CartItem] = []
     price: float = 0.0
 
+    @staticmethod
+    def from_entity(entity: CartEntity) -> Cart:
+        return Cart(
+            id=entity.id,
+            items=[
+                CartItem(id=line.id, name=line.name, quantity=line.quantity, available=line.available)
+                for line in entity.items
+            ],
+            price=entity.price,
+        )
+
 class CartRequest(BaseModel):
     item_id: int
+    quantity: PositiveInt = 1
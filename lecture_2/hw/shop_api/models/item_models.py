@@ -1,5 +1,8 @@
-from pydantic import BaseModel, ConfigDict
+from __future__ import annotations
+
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional
+from ..storage.entities import ItemEntity, ItemInfo, PatchItemInfo
 
 
 class Item(BaseModel):
@@ -8,13 +11,24 @@ class Item(BaseModel):
     price: float
     deleted: bool = False
 
+    @staticmethod
+    def from_entity(entity: ItemEntity) -> Item:
+        return Item(id=entity.id, name=entity.name, price=entity.price, deleted=entity.deleted)
+
 
 class ItemRequest(BaseModel):
     name: str
-    price: float
+    # NaN cannot be ordered in the price index, and SQLite stores it as NULL
+    price: float = Field(allow_inf_nan=False)
+
+    def as_item_info(self) -> ItemInfo:
+        return ItemInfo(name=self.name, price=self.price)
 
 
 class ItemPatchRequest(BaseModel):
     name: Optional[str] = None
-    price: Optional[float] = None
+    price: Optional[float] = Field(None, allow_inf_nan=False)
     model_config = ConfigDict(extra="forbid")
+
+    def as_patch_item_info(self) -> PatchItemInfo:
+        return PatchItemInfo(name=self.name, price=self.price)
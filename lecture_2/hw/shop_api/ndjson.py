@@ -0,0 +1,22 @@
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator
+from pydantic import BaseModel
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+
+
+async def iter_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """Split a streamed body into non-empty lines without buffering the whole body."""
+    tail = b''
+    async for chunk in chunks:
+        *lines, tail = (tail + chunk).split(b'\n')
+        for line in lines:
+            if line.strip():
+                yield line
+    if tail.strip():
+        yield tail
+
+
+def dump_lines(chunks: Iterable[Iterable[BaseModel]]) -> Iterator[bytes]:
+    """Encode every chunk of models as one block of NDJSON lines."""
+    for chunk in chunks:
+        yield b''.join(model.model_dump_json().encode() + b'\n' for model in chunk)
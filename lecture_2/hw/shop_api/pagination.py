@@ -0,0 +1,25 @@
+import json
+import math
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from fastapi import Request
+
+
+# cursors are opaque to clients: an (order, value, id) sort key of the last entity of a page
+def encode_cursor(key: tuple[str, float, int]) -> str:
+    return urlsafe_b64encode(json.dumps(key, separators=(',', ':')).encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple[str, float, int]:
+    try:
+        order, value, id = json.loads(urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError) as e:
+        raise ValueError('Malformed cursor') from e
+
+    # json.loads accepts NaN and Infinity, and 1e400 overflows to infinity
+    if (not isinstance(order, str) or isinstance(value, bool) or not isinstance(value, (int, float))
+            or not math.isfinite(value) or type(id) is not int):
+        raise ValueError('Malformed cursor')
+    return order, value, id
+
+def next_page_link(request: Request, key: tuple[str, float, int]) -> str:
+    url = request.url.remove_query_params('offset').include_query_params(cursor=encode_cursor(key))
+    return f'<{url}>; rel="next"'
@@ -0,0 +1,38 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from types import FrameType
+
+
+def _collapse(thread: str, frame: FrameType) -> str:
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+        frame = frame.f_back
+    return ';'.join([thread, *reversed(frames)])
+
+
+def sample_stacks(seconds: float, interval: float = 0.005) -> Counter[str]:
+    """Sample the stacks of every other thread of the process every `interval` seconds.
+
+    Returns how often each stack was seen, keyed by the stack in collapsed form:
+    the thread name, then frames from the outermost in, separated by `;`.
+    """
+    me = threading.get_ident()
+    stacks = Counter[str]()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident != me:
+                stacks[_collapse(names.get(ident, str(ident)), frame)] += 1
+        time.sleep(interval)
+    return stacks
+
+
+def collapsed(stacks: Counter[str]) -> str:
+    """Stacks in the folded format read by flamegraph.pl and speedscope, one `stack count` per line."""
+    return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
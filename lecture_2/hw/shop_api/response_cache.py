@@ -0,0 +1,60 @@
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Generic, Hashable, Optional, TypeVar
+from prometheus_client import Counter
+from .storage.aio import get_cart_generation, get_item_generation
+
+Value = TypeVar('Value')
+
+# registered in the default registry, which the Instrumentator exposes on /metrics
+CACHE_HITS = Counter('shop_response_cache_hits_total', 'Listings served from the response cache', ['cache'])
+CACHE_MISSES = Counter('shop_response_cache_misses_total', 'Listings loaded from storage', ['cache'])
+
+
+class ResponseCache(Generic[Value]):
+    """LRU cache of listing responses keyed on the listing arguments.
+
+    An entry is only served while the generation it was loaded at is still current and
+    it is younger than `ttl` seconds, so any write to the listed entities invalidates every
+    entry. `generation` reads the generation of those entities.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        generation: Callable[[], Awaitable[tuple[str, int]]],
+        maxsize: int = 256,
+        ttl: float = 30.0) -> None:
+        self._generation = generation
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._entries = OrderedDict[Hashable, tuple[tuple[str, int], float, Value]]()
+        self._hits = CACHE_HITS.labels(name)
+        self._misses = CACHE_MISSES.labels(name)
+
+    async def get_or_load(self, key: Hashable, load: Callable[[], Awaitable[Value]]) -> Value:
+        # the generation is read before loading, so a write during the load leaves the entry stale
+        generation = await self._generation()
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == generation and now - entry[1] < self._ttl:
+            self._entries.move_to_end(key)
+            self._hits.inc()
+            return entry[2]
+
+        self._misses.inc()
+        value = await load()
+        self._entries[key] = (generation, now, value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+# a listing is cached as its encoded page and the sort key of its last entity if the page is full;
+# the Link header is built per request, as it depends on the request URL
+items_cache = ResponseCache[tuple[bytes, Optional[tuple]]]('items', get_item_generation)
+carts_cache = ResponseCache[tuple[bytes, Optional[tuple]]]('carts', get_cart_generation)
@@ -0,0 +1,37 @@
+import asyncio
+from http import HTTPStatus
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+from ..profiling import collapsed, sample_stacks
+
+router_admin = APIRouter(prefix='/admin')
+
+# samples from two overlapping profiles would mix, so only one runs at a time
+_profiling = asyncio.Lock()
+
+@router_admin.get(
+    '/profile',
+    responses={
+        HTTPStatus.OK: {
+            'description': 'Success: sampled stacks of every thread in collapsed (folded) form',
+            'content': {'text/plain': {}},
+        },
+        HTTPStatus.CONFLICT: {
+            'description': 'Fail: another profile is running',
+        },
+        HTTPStatus.UNPROCESSABLE_ENTITY: {
+            'description': 'Fail: duration or interval out of range',
+        },
+    },
+    status_code=HTTPStatus.OK,
+    response_class=PlainTextResponse)
+async def profile(seconds: float = 5.0, interval: float = 0.005) -> PlainTextResponse:
+    if not 0 < seconds <= 60 or not 0.001 <= interval <= 1:
+        raise HTTPException(HTTPStatus.UNPROCESSABLE_ENTITY)
+    if _profiling.locked():
+        raise HTTPException(HTTPStatus.CONFLICT, 'A profile is already running')
+
+    async with _profiling:
+        # the sampler runs in a worker thread, so the event loop keeps serving the traffic being profiled
+        stacks = await asyncio.to_thread(sample_stacks, seconds, interval)
+    return PlainTextResponse(collapsed(stacks))
@@ -1,9 +1,15 @@
 from http import HTTPStatus
-from typing import List, Optional
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import Response
-from ..models.cart_models import Cart
-from ..storage import create_cart as crt_cart, get_cart as gt_cart, get_carts as gt_carts, add_item_to_cart as ad_item_to_cart
+from typing import Annotated, List, Optional
+from fastapi import APIRouter, Header, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from ..conditional import etag_matches
+from ..encoding import encode_cart, json_array, json_response
+from ..models.cart_models import Cart, CartRequest
+from ..ndjson import NDJSON_MEDIA_TYPE, dump_lines
+from ..pagination import decode_cursor, next_page_link
+from ..response_cache import carts_cache
+from ..storage import cart_key, iter_carts
+from ..storage.aio import create_cart as crt_cart, get_cart as gt_cart, get_cart_etag as gt_cart_etag, get_carts as gt_carts, add_item_to_cart as ad_item_to_cart, add_items_to_cart as ad_items_to_cart
 
 router_cart = APIRouter(prefix='/cart')
 
@@ -21,31 +27,60 @@ router_cart = APIRouter(prefix='/cart')
     response_model=Cart)
 async def create_cart(response: Response) -> Cart:
     try:
-        cart = crt_cart()
+        cart = await crt_cart()
         response.headers['location'] = f'/cart/{cart.id}'
-        return cart
+        return Cart.from_entity(cart)
     except ValueError:
         raise HTTPException(HTTPStatus.UNPROCESSABLE_ENTITY)
 
 
+@router_cart.get(
+    '/export',
+    responses={
+        HTTPStatus.OK: {
+            'description': 'Success: every cart as one JSON object per line',
+            'content': {NDJSON_MEDIA_TYPE: {}},
+        },
+    },
+    status_code=HTTPStatus.OK,
+    response_class=StreamingResponse)
+async def export_carts() -> StreamingResponse:
+    return StreamingResponse(dump_lines([Cart.from_entity(cart) for cart in chunk] for chunk in iter_carts()), media_type=NDJSON_MEDIA_TYPE)
+
+
 @router_cart.get(
     '/{cart_id}',
     responses={
         HTTPStatus.OK: {
             'description': 'Success',
         },
+        HTTPStatus.NOT_MODIFIED: {
+            'description': 'Success: cart still matches the ETag in If-None-Match',
+        },
+        HTTPStatus.NOT_FOUND: {
+            'description': 'Fail: no such cart, or it expired',
+        },
         HTTPStatus.UNPROCESSABLE_ENTITY: {
             'description': 'Fail',
         },
     },
     status_code=HTTPStatus.OK,
     response_model=Cart)
-async def get_cart(cart_id: int) -> Cart:
+async def get_cart(
+    cart_id: int,
+    if_none_match: Annotated[Optional[str], Header()] = None) -> Cart:
+    # the version is read before the cart, so a concurrent change can only make the ETag stale, never the body
+    etag = await gt_cart_etag(cart_id)
+    if etag is not None and etag_matches(if_none_match, etag):
+        return Response(status_code=HTTPStatus.NOT_MODIFIED, headers={'etag': etag})
+
     try:
-        cart = gt_cart(cart_id)
+        cart = await gt_cart(cart_id)
     except ValueError:
         raise HTTPException(HTTPStatus.UNPROCESSABLE_ENTITY)
-    return cart
+    if cart is None:
+        raise HTTPException(HTTPStatus.NOT_FOUND, 'Cart not found')
+    return json_response(encode_cart(cart), None if etag is None else {'etag': etag})
 
 
 @router_cart.get(
@@ -61,19 +96,31 @@ async def get_cart(cart_id: int) -> Cart:
     status_code=HTTPStatus.OK,
     response_model=List[Cart])
 async def get_carts(
+    request: Request,
     offset: Optional[int] = 0,
     limit: Optional[int] = 10,
     min_price: Optional[float] = None,
     max_price: Optional[float] = None,
     min_quantity: Optional[int] = None,
-    max_quantity: Optional[int] = None) -> List[Cart]:
+    max_quantity: Optional[int] = None,
+    cursor: Optional[str] = None) -> List[Cart]:
+    async def load() -> tuple[bytes, Optional[tuple]]:
+        carts = await gt_carts(
+            offset, limit, min_price, max_price, min_quantity, max_quantity, after
+        )
+        last_key = None
+        if len(carts) == limit:
+            last_key = cart_key(carts[-1], min_price, max_price, min_quantity, max_quantity)
+        return json_array(map(encode_cart, carts)), last_key
+
     try:
-        carts = gt_carts(
-            offset, limit, min_price, max_price, min_quantity, max_quantity
+        after = None if cursor is None else decode_cursor(cursor)
+        content, last_key = await carts_cache.get_or_load(
+            (offset, limit, min_price, max_price, min_quantity, max_quantity, after), load
         )
     except ValueError:
         raise HTTPException(HTTPStatus.UNPROCESSABLE_ENTITY)
-    return carts
+    return json_response(content, None if last_key is None else {'link': next_page_link(request, last_key)})
 
 
 @router_cart.post(
@@ -90,7 +137,27 @@ async def get_carts(
     response_model=Cart)
 async def add_item_to_cart(cart_id: int, item_id: int) -> Cart:
     try:
-        cart = ad_item_to_cart(cart_id, item_id)
+        cart = await ad_item_to_cart(cart_id, item_id)
+    except ValueError:
+        raise HTTPException(HTTPStatus.UNPROCESSABLE_ENTITY)
+    return Cart.from_entity(cart)
+
+
+@router_cart.post(
+    '/{cart_id}/add',
+    responses={
+        HTTPStatus.CREATED: {
+            'description': 'Successfully added all items to cart',
+        },
+        HTTPStatus.UNPROCESSABLE_ENTITY: {
+            'description': 'Failed to add items to cart, none were added',
+        },
+    },
+    status_code=HTTPStatus.CREATED,
+    response_model=Cart)
+async def add_items_to_cart(cart_id: int, lines: List[CartRequest]) -> Cart:
+    try:
+        cart = await ad_items_to_cart(cart_id, [(line.item_id, line.quantity) for line in lines])
     except ValueError:
         raise HTTPException(HTTPStatus.UNPROCESSABLE_ENTITY)
-    return cart
\ No newline at end of file
+    return Cart.from_entity(cart)
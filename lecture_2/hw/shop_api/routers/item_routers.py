@@ -1,12 +1,21 @@
 from http import HTTPStatus
-from typing import Optional, List
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import Response
+from typing import Annotated, Optional, List
+from fastapi import APIRouter, Header, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from pydantic import TypeAdapter
+from ..conditional import etag_matches
+from ..encoding import encode_item, json_array, json_response
 from ..models.item_models import Item, ItemRequest, ItemPatchRequest
-from ..storage import create_item as cr_item, get_item as gt_item, get_items as gt_items, update_item as upd_items, patch_item as ptch_item, delete_item as dlt_item
+from ..ndjson import NDJSON_MEDIA_TYPE, dump_lines, iter_lines
+from ..pagination import decode_cursor, next_page_link
+from ..response_cache import items_cache
+from ..storage import item_key, iter_items
+from ..storage.aio import create_item as cr_item, create_items as cr_items, get_item as gt_item, get_item_etag as gt_item_etag, get_items as gt_items, update_item as upd_items, patch_item as ptch_item, delete_item as dlt_item
 
 router_item = APIRouter(prefix='/item')
 
+item_requests_adapter = TypeAdapter(List[ItemRequest])
+
 @router_item.post(
     '/',
     responses={
@@ -21,30 +30,88 @@ router_item = APIRouter(prefix='/item')
     response_model=Item)
 async def create_item(item_request: ItemRequest, response: Response) -> Item:
     try:
-        item = cr_item(item_request)
+        item = await cr_item(item_request.as_item_info())
         response.headers['location'] = f'/item/{item.id}'
-        return item
+        return Item.from_entity(item)
+    except ValueError:
+        raise HTTPException(HTTPStatus.UNPROCESSABLE_ENTITY)
+
+
+@router_item.post(
+    '/batch',
+    responses={
+        HTTPStatus.CREATED: {
+            'description': 'Success: created all items',
+        },
+        HTTPStatus.UNPROCESSABLE_ENTITY: {
+            'description': 'Fail: did not create any item',
+        },
+    },
+    status_code=HTTPStatus.CREATED,
+    response_model=List[Item],
+    openapi_extra={
+        'requestBody': {
+            'content': {
+                'application/json': {'schema': item_requests_adapter.json_schema()},
+                NDJSON_MEDIA_TYPE: {'schema': ItemRequest.model_json_schema()},
+            },
+            'required': True,
+        },
+    })
+async def create_items(request: Request) -> List[Item]:
+    # the body is either a JSON array or NDJSON with one item per line; NDJSON is
+    # validated line by line as it arrives, and items are only created once all lines are valid
+    try:
+        if request.headers.get('content-type', '').startswith(NDJSON_MEDIA_TYPE):
+            item_requests = [ItemRequest.model_validate_json(line) async for line in iter_lines(request.stream())]
+        else:
+            item_requests = item_requests_adapter.validate_json(await request.body())
+        return [Item.from_entity(item) for item in await cr_items([r.as_item_info() for r in item_requests])]
     except ValueError:
         raise HTTPException(HTTPStatus.UNPROCESSABLE_ENTITY)
 
 
+@router_item.get(
+    '/export',
+    responses={
+        HTTPStatus.OK: {
+            'description': 'Success: every item as one JSON object per line',
+            'content': {NDJSON_MEDIA_TYPE: {}},
+        },
+    },
+    status_code=HTTPStatus.OK,
+    response_class=StreamingResponse)
+async def export_items(show_deleted: bool = True) -> StreamingResponse:
+    return StreamingResponse(dump_lines([Item.from_entity(item) for item in chunk] for chunk in iter_items(show_deleted)), media_type=NDJSON_MEDIA_TYPE)
+
+
 @router_item.get(
     '/{id}',
     responses={
         HTTPStatus.OK: {
             'description': 'Success',
         },
+        HTTPStatus.NOT_MODIFIED: {
+            'description': 'Success: item still matches the ETag in If-None-Match',
+        },
         HTTPStatus.NOT_FOUND: {
             'description': 'Fail',
         },
     },
     status_code=HTTPStatus.OK,
     response_model=Item)
-async def get_item(id: int) -> Item:
-    item = gt_item(id)
+async def get_item(
+    id: int,
+    if_none_match: Annotated[Optional[str], Header()] = None) -> Item:
+    # the version is read before the item, so a concurrent change can only make the ETag stale, never the body
+    etag = await gt_item_etag(id)
+    if etag is not None and etag_matches(if_none_match, etag):
+        return Response(status_code=HTTPStatus.NOT_MODIFIED, headers={'etag': etag})
+
+    item = await gt_item(id)
     if item is None or item.deleted:
         raise HTTPException(HTTPStatus.NOT_FOUND, 'Item not found')
-    return item
+    return json_response(encode_item(item), {'etag': etag})
 
 
 @router_item.get(
@@ -60,16 +127,24 @@ async def get_item(id: int) -> Item:
     status_code=HTTPStatus.OK,
     response_model=List[Item])
 async def get_items(
+    request: Request,
     offset: Optional[int] = 0,
     limit: Optional[int] = 10,
     min_price: Optional[float] = None,
     max_price: Optional[float] = None,
-    show_deleted: bool = False):
+    show_deleted: bool = False,
+    cursor: Optional[str] = None,
+    q: Optional[str] = None):
+    async def load() -> tuple[bytes, Optional[tuple]]:
+        items = await gt_items(offset, limit, min_price, max_price, show_deleted, after, q)
+        return json_array(map(encode_item, items)), item_key(items[-1]) if len(items) == limit else None
+
     try:
-        items = gt_items(offset, limit, min_price, max_price, show_deleted)
+        after = None if cursor is None else decode_cursor(cursor)
+        content, last_key = await items_cache.get_or_load((offset, limit, min_price, max_price, show_deleted, after, q), load)
     except ValueError:
         raise HTTPException(status_code=HTTPStatus.UNPROCESSABLE_ENTITY)
-    return items
+    return json_response(content, None if last_key is None else {'link': next_page_link(request, last_key)})
 
 
 @router_item.put(
@@ -86,10 +161,10 @@ async def get_items(
     response_model=Item)
 async def update_item(id: int, item_request: ItemRequest) -> Item:
     try:
-        updated_item = upd_items(id, item_request)
+        updated_item = await upd_items(id, item_request.as_item_info())
     except ValueError:
         raise HTTPException(HTTPStatus.UNPROCESSABLE_ENTITY)
-    return updated_item
+    return Item.from_entity(updated_item)
 
 
 @router_item.patch(
@@ -106,10 +181,10 @@ async def update_item(id: int, item_request: ItemRequest) -> Item:
     response_model=Item)
 async def patch_item(id: int, item_patch_request: ItemPatchRequest) -> Item:
     try:
-        item = ptch_item(id, item_patch_request)
+        item = await ptch_item(id, item_patch_request.as_patch_item_info())
     except ValueError:
         raise HTTPException(HTTPStatus.NOT_MODIFIED)
-    return item
+    return Item.from_entity(item)
 
 
 @router_item.delete(
@@ -124,7 +199,7 @@ async def patch_item(id: int, item_patch_request: ItemPatchRequest) -> Item:
     response_model=Item)
 async def delete_item(id: int):
     try:
-        item = dlt_item(id)
+        item = await dlt_item(id)
     except Exception:
         raise HTTPException(HTTPStatus.NOT_FOUND)
-    return item
+    return Item.from_entity(item)
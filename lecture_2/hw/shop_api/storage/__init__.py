@@ -0,0 +1,241 @@
+"""Shop storage.
+
+The backend is chosen by the `SHOP_STORAGE` environment variable:
+
+- `memory` (default) - process-local dicts with sorted indexes; lost on restart unless
+  `SHOP_DATA_DIR` names a directory for its operation log and snapshots. Carts idle for
+  `SHOP_CART_TTL` seconds expire and at most `SHOP_MAX_CARTS` are kept (both unlimited by
+  default); deleted items are compacted and carts expired every `SHOP_MAINTENANCE_INTERVAL`
+  seconds (default 60);
+- `sqlite` - a SQLite database at `SHOP_SQLITE_PATH` (default `shop.db`) that can be
+  shared by several uvicorn workers.
+
+Code on the event loop uses the awaitable functions of `storage.aio`, which run the calls
+of a blocking backend in a thread pool.
+"""
+
+import math
+import os
+from typing import Iterator, List, Optional
+from prometheus_client import REGISTRY
+from .base import Storage, cart_order
+from .entities import CartEntity, CartItemEntity, ItemEntity, ItemInfo, PatchItemInfo, StorageStats
+from .metrics import STORAGE_CALL_SECONDS, StatsCollector
+from .search import tokenize
+from .memory import MemoryStorage
+from .sqlite import SQLiteStorage
+
+
+def create_storage() -> Storage:
+    backend = os.environ.get('SHOP_STORAGE', 'memory')
+    if backend == 'memory':
+        cart_ttl, max_carts = os.environ.get('SHOP_CART_TTL'), os.environ.get('SHOP_MAX_CARTS')
+        options = dict(
+            maintenance_interval=float(os.environ.get('SHOP_MAINTENANCE_INTERVAL', '60')),
+            cart_ttl=None if cart_ttl is None else float(cart_ttl),
+            max_carts=None if max_carts is None else int(max_carts),
+        )
+        data_dir = os.environ.get('SHOP_DATA_DIR')
+        if data_dir is None:
+            return MemoryStorage(**options)
+        return MemoryStorage.recover(data_dir, **options)
+    if backend == 'sqlite':
+        return SQLiteStorage(os.environ.get('SHOP_SQLITE_PATH', 'shop.db'))
+    raise ValueError(f'Unknown SHOP_STORAGE backend: {backend}')
+
+
+_storage = create_storage()
+
+
+def get_storage() -> Storage:
+    return _storage
+
+def set_storage(storage: Storage) -> None:
+    global _storage
+    _storage = storage
+
+def get_item_generation() -> tuple[str, int]:
+    """Identifies the current state of the items; it changes with every write to them."""
+    return _storage.epoch, _storage.get_item_generation()
+
+def get_cart_generation() -> tuple[str, int]:
+    """Identifies the current state of the carts; it also changes when an item change reprices them."""
+    return _storage.epoch, _storage.get_cart_generation()
+
+def get_stats() -> StorageStats:
+    return _storage.get_stats()
+
+# exported on /metrics next to the HTTP metrics; read from whichever store is current
+REGISTRY.register(StatsCollector(get_stats))
+
+def create_cart() -> CartEntity:
+    return _storage.create_cart()
+
+def get_cart(id: int) -> Optional[CartEntity]:
+    return _storage.get_cart(id)
+
+def get_cart_etag(id: int) -> Optional[str]:
+    version = _storage.get_cart_version(id)
+    return None if version is None else f'"{_storage.epoch}-{version}"'
+
+@STORAGE_CALL_SECONDS.labels('get_carts').time()
+def get_carts(
+    offset: int,
+    limit: int,
+    min_price: Optional[float],
+    max_price: Optional[float],
+    min_quantity: Optional[int],
+    max_quantity: Optional[int],
+    after: Optional[tuple[str, float, int]] = None) -> Optional[List[CartEntity]]:
+    if offset < 0 or limit <= 0:
+        raise ValueError
+
+    params = [min_price, max_price, min_quantity, max_quantity]
+    for param in params:
+        if param is not None and param < 0:
+            raise ValueError
+
+    if after is not None and after[0] != cart_order(min_price, max_price, min_quantity, max_quantity):
+        raise ValueError
+
+    return _storage.get_carts(
+        offset, limit, min_price, max_price, min_quantity, max_quantity, None if after is None else after[1:])
+
+def cart_key(
+    cart: CartEntity,
+    min_price: Optional[float],
+    max_price: Optional[float],
+    min_quantity: Optional[int],
+    max_quantity: Optional[int]) -> tuple[str, float, int]:
+    order = cart_order(min_price, max_price, min_quantity, max_quantity)
+    if order == 'quantity':
+        return order, cart.quantity, cart.id
+    return order, cart.price, cart.id
+
+@STORAGE_CALL_SECONDS.labels('add_item_to_cart').time()
+def add_item_to_cart(cart_id: int, item_id: int) -> CartEntity:
+    return _storage.add_item_to_cart(cart_id, item_id)
+
+@STORAGE_CALL_SECONDS.labels('add_items_to_cart').time()
+def add_items_to_cart(cart_id: int, lines: List[tuple[int, int]]) -> CartEntity:
+    if any(quantity <= 0 for _, quantity in lines):
+        raise ValueError
+
+    return _storage.add_items_to_cart(cart_id, lines)
+
+def _check_price(price: float) -> None:
+    # NaN compares false with everything, so it would corrupt the sorted price indexes
+    if not math.isfinite(price):
+        raise ValueError
+
+def create_item(info: ItemInfo) -> ItemEntity:
+    _check_price(info.price)
+    return _storage.create_item(info)
+
+def create_items(infos: List[ItemInfo]) -> List[ItemEntity]:
+    for info in infos:
+        _check_price(info.price)
+    return _storage.create_items(infos)
+
+def get_item(id: int) -> Optional[ItemEntity]:
+    return _storage.get_item(id)
+
+def get_item_etag(id: int) -> Optional[str]:
+    version = _storage.get_item_version(id)
+    return None if version is None else f'"{_storage.epoch}-{version}"'
+
+@STORAGE_CALL_SECONDS.labels('get_items').time()
+def get_items(
+    offset: int,
+    limit: int,
+    min_price: Optional[float],
+    max_price: Optional[float],
+    show_deleted: bool,
+    after: Optional[tuple[str, float, int]] = None,
+    query: Optional[str] = None) -> Optional[List[ItemEntity]]:
+    """Items in `(price, id)` order; a `query` keeps those whose name has a word
+    starting with each word of the query."""
+    if offset < 0 or limit <= 0:
+        raise ValueError
+
+    if (min_price is not None and min_price < 0) or (max_price is not None and max_price < 0):
+        raise ValueError
+
+    if after is not None and after[0] != 'price':
+        raise ValueError
+
+    tokens = None if query is None else tokenize(query)
+    if tokens == []:
+        raise ValueError
+
+    return _storage.get_items(
+        offset, limit, min_price, max_price, show_deleted, None if after is None else after[1:], tokens)
+
+def item_key(item: ItemEntity) -> tuple[str, float, int]:
+    return 'price', item.price, item.id
+
+def iter_items(show_deleted: bool, chunk_size: int = 1000) -> Iterator[List[ItemEntity]]:
+    """Walk all items in (price, id) order, one keyset page at a time.
+
+    Only a chunk is held in memory. This is not a snapshot: an item repriced
+    during the walk may be seen twice or not at all.
+    """
+    after = None
+    while items := get_items(0, chunk_size, None, None, show_deleted, after):
+        yield items
+        after = item_key(items[-1])
+
+def iter_carts(chunk_size: int = 1000) -> Iterator[List[CartEntity]]:
+    """Walk all carts in (price, id) order like `iter_items`."""
+    after = None
+    while carts := get_carts(0, chunk_size, None, None, None, None, after):
+        yield carts
+        after = cart_key(carts[-1], None, None, None, None)
+
+def patch_item(id: int, patch_info: PatchItemInfo) -> Optional[ItemEntity]:
+    if patch_info.price is not None:
+        _check_price(patch_info.price)
+    return _storage.patch_item(id, patch_info)
+
+def update_item(id: int, info: ItemInfo) -> Optional[ItemEntity]:
+    return patch_item(id, PatchItemInfo(name=info.name, price=info.price))
+
+def delete_item(id: int) -> Optional[ItemEntity]:
+    return _storage.delete_item(id)
+
+
+__all__ = [
+    "Storage",
+    "MemoryStorage",
+    "SQLiteStorage",
+    "CartEntity",
+    "CartItemEntity",
+    "ItemEntity",
+    "ItemInfo",
+    "PatchItemInfo",
+    "StorageStats",
+    "create_storage",
+    "get_storage",
+    "set_storage",
+    "get_item_generation",
+    "get_cart_generation",
+    "get_stats",
+    "create_cart",
+    "get_cart",
+    "get_cart_etag",
+    "get_carts",
+    "cart_key",
+    "add_item_to_cart",
+    "add_items_to_cart",
+    "create_item",
+    "create_items",
+    "get_item",
+    "get_item_etag",
+    "get_items",
+    "item_key",
+    "iter_items",
+    "iter_carts",
+    "patch_item",
+    "update_item",
+    "delete_item",
+]
@@ -0,0 +1,88 @@
+"""Awaitable versions of the storage functions, for code running on the event loop.
+
+A call runs inline when the current backend never waits on I/O for it (the memory
+store, or its reads when journaled) and in a bounded pool of `SHOP_STORAGE_THREADS`
+threads (default 8) otherwise, so a slow disk stalls only the calls that touch it.
+With `SHOP_STORAGE_THREADS=0` every call runs inline.
+"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+from typing import Awaitable, Callable, Optional, ParamSpec, TypeVar
+from . import (
+    get_storage, get_item_generation as _get_item_generation,
+    get_cart_generation as _get_cart_generation, create_cart as _create_cart, get_cart as _get_cart,
+    get_cart_etag as _get_cart_etag, get_carts as _get_carts, add_item_to_cart as _add_item_to_cart,
+    add_items_to_cart as _add_items_to_cart, create_item as _create_item, create_items as _create_items,
+    get_item as _get_item, get_item_etag as _get_item_etag, get_items as _get_items, patch_item as _patch_item,
+    update_item as _update_item, delete_item as _delete_item,
+)
+
+P = ParamSpec('P')
+R = TypeVar('R')
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def set_offload_threads(threads: int) -> None:
+    """Size the pool blocking calls run in; 0 runs them on the event loop."""
+    global _executor
+    previous = _executor
+    _executor = ThreadPoolExecutor(threads, thread_name_prefix='storage') if threads > 0 else None
+    if previous is not None:
+        previous.shutdown(wait=False)
+
+set_offload_threads(int(os.environ.get('SHOP_STORAGE_THREADS', '8')))
+
+
+def _awaitable(function: Callable[P, R], writes: bool) -> Callable[P, Awaitable[R]]:
+    @wraps(function)
+    async def call(*args: P.args, **kwargs: P.kwargs) -> R:
+        storage = get_storage()
+        executor = _executor
+        if executor is None or not (storage.blocking_writes if writes else storage.blocking_reads):
+            return function(*args, **kwargs)
+        # the pool's queue is where calls wait once all its threads are busy, never the event loop
+        return await asyncio.get_running_loop().run_in_executor(executor, partial(function, *args, **kwargs))
+    return call
+
+
+get_item_generation = _awaitable(_get_item_generation, writes=False)
+get_cart_generation = _awaitable(_get_cart_generation, writes=False)
+create_cart = _awaitable(_create_cart, writes=True)
+get_cart = _awaitable(_get_cart, writes=False)
+get_cart_etag = _awaitable(_get_cart_etag, writes=False)
+get_carts = _awaitable(_get_carts, writes=False)
+add_item_to_cart = _awaitable(_add_item_to_cart, writes=True)
+add_items_to_cart = _awaitable(_add_items_to_cart, writes=True)
+create_item = _awaitable(_create_item, writes=True)
+create_items = _awaitable(_create_items, writes=True)
+get_item = _awaitable(_get_item, writes=False)
+get_item_etag = _awaitable(_get_item_etag, writes=False)
+get_items = _awaitable(_get_items, writes=False)
+patch_item = _awaitable(_patch_item, writes=True)
+update_item = _awaitable(_update_item, writes=True)
+delete_item = _awaitable(_delete_item, writes=True)
+
+
+__all__ = [
+    "set_offload_threads",
+    "get_item_generation",
+    "get_cart_generation",
+    "create_cart",
+    "get_cart",
+    "get_cart_etag",
+    "get_carts",
+    "add_item_to_cart",
+    "add_items_to_cart",
+    "create_item",
+    "create_items",
+    "get_item",
+    "get_item_etag",
+    "get_items",
+    "patch_item",
+    "update_item",
+    "delete_item",
+]
@@ -0,0 +1,107 @@
+from abc import ABC, abstractmethod
+from typing import List, Optional
+from .entities import CartEntity, ItemEntity, ItemInfo, PatchItemInfo, StorageStats
+
+
+def cart_order(
+    min_price: Optional[float],
+    max_price: Optional[float],
+    min_quantity: Optional[int],
+    max_quantity: Optional[int]) -> str:
+    """Key carts are listed by: `quantity` if only quantity bounds are given, `price` otherwise."""
+    if min_price is None and max_price is None and (min_quantity is not None or max_quantity is not None):
+        return 'quantity'
+    return 'price'
+
+
+class Storage(ABC):
+    """Backend behind the functions exported by the `storage` package.
+
+    Arguments are validated by the package functions before they reach a backend.
+    Missing or deleted entities that cannot be modified are reported with ValueError.
+
+    Entities are returned as copies, so callers never see later changes to them.
+
+    Every item and cart has a version that changes whenever the entity does; `epoch`
+    identifies the store, so versions of different stores (e.g. before and after a
+    restart of the memory backend) are never confused. The item generation changes with
+    every write that changes what item listings show, the cart generation with every
+    write that changes what cart listings show, including item changes that reprice carts.
+
+    Listings are ordered by `(price, id)` for items and by `(<cart_order>, id)` for carts;
+    `after` is such a key, and only entities ordered after it are returned.
+    """
+
+    epoch: str
+    # whether reads or writes may wait on I/O, so that `aio` runs them outside the event loop
+    blocking_reads: bool = False
+    blocking_writes: bool = False
+
+    @abstractmethod
+    def get_item_generation(self) -> int: ...
+
+    @abstractmethod
+    def get_cart_generation(self) -> int: ...
+
+    @abstractmethod
+    def get_stats(self) -> StorageStats: ...
+
+    @abstractmethod
+    def create_cart(self) -> CartEntity: ...
+
+    @abstractmethod
+    def get_cart(self, id: int) -> Optional[CartEntity]: ...
+
+    @abstractmethod
+    def get_cart_version(self, id: int) -> Optional[int]:
+        """Version of a cart, None if it is missing; like `get_cart`, it counts as reading the cart."""
+
+    @abstractmethod
+    def get_carts(
+        self,
+        offset: int,
+        limit: int,
+        min_price: Optional[float],
+        max_price: Optional[float],
+        min_quantity: Optional[int],
+        max_quantity: Optional[int],
+        after: Optional[tuple[float, int]] = None) -> List[CartEntity]: ...
+
+    def add_item_to_cart(self, cart_id: int, item_id: int) -> CartEntity:
+        return self.add_items_to_cart(cart_id, [(item_id, 1)])
+
+    @abstractmethod
+    def add_items_to_cart(self, cart_id: int, lines: List[tuple[int, int]]) -> CartEntity:
+        """Add `(item_id, quantity)` lines to a cart; nothing is added if the cart or any item is missing."""
+
+    @abstractmethod
+    def create_item(self, info: ItemInfo) -> ItemEntity: ...
+
+    @abstractmethod
+    def create_items(self, infos: List[ItemInfo]) -> List[ItemEntity]: ...
+
+    @abstractmethod
+    def get_item(self, id: int) -> Optional[ItemEntity]: ...
+
+    @abstractmethod
+    def get_item_version(self, id: int) -> Optional[int]:
+        """Version of a live item; None if it is missing or deleted, as it then has no representation to match."""
+
+    @abstractmethod
+    def get_items(
+        self,
+        offset: int,
+        limit: int,
+        min_price: Optional[float],
+        max_price: Optional[float],
+        show_deleted: bool,
+        after: Optional[tuple[float, int]] = None,
+        query: Optional[List[str]] = None) -> List[ItemEntity]:
+        """Items in `(price, id)` order; with a `query` (tokens from `search.tokenize`), only
+        those whose name has a token starting with each query token."""
+
+    @abstractmethod
+    def patch_item(self, id: int, patch_info: PatchItemInfo) -> ItemEntity: ...
+
+    @abstractmethod
+    def delete_item(self, id: int) -> ItemEntity: ...
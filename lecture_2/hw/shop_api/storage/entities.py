@@ -0,0 +1,52 @@
+from dataclasses import dataclass, field
+
+
+@dataclass(slots=True)
+class ItemInfo:
+    name: str
+    price: float
+
+
+@dataclass(slots=True)
+class PatchItemInfo:
+    name: str | None = None
+    price: float | None = None
+
+
+@dataclass(slots=True)
+class ItemEntity:
+    id: int
+    name: str
+    price: float
+    deleted: bool = False
+    version: int = 0
+
+
+@dataclass(slots=True, frozen=True)
+class CartItemEntity:
+    id: int
+    name: str
+    quantity: int = 1
+    available: bool = True
+
+
+@dataclass(slots=True)
+class CartEntity:
+    id: int
+    items: list[CartItemEntity] = field(default_factory=list)
+    price: float = 0.0
+    # total quantity over all lines
+    quantity: int = 0
+    version: int = 0
+
+
+@dataclass(slots=True)
+class StorageStats:
+    # items not deleted
+    items: int
+    deleted_items: int
+    # deleted items still in the listing index, skipped by every listing that walks over them
+    tombstones: int
+    carts: int
+    # lines over all carts
+    cart_lines: int
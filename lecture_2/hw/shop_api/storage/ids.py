@@ -0,0 +1,46 @@
+import threading
+from typing import Callable
+
+# lease(size) reserves `size` consecutive ids of a sequence and returns the first one
+Lease = Callable[[int], int]
+
+
+def counter_lease(start: int = 0) -> Lease:
+    """Lease blocks from a process-local counter."""
+    next_id = start
+    lock = threading.Lock()
+
+    def lease(size: int) -> int:
+        nonlocal next_id
+        with lock:
+            first, next_id = next_id, next_id + size
+        return first
+
+    return lease
+
+
+class IdAllocator:
+    """Allocates ids of one sequence from blocks leased in advance.
+
+    Only every `block_size`-th call reaches the lease source, so workers sharing
+    a sequence coordinate once per block instead of once per insert. Ids are
+    consecutive within a block; the unused tail of a block is lost when the
+    process exits.
+    """
+
+    def __init__(self, lease: Lease, block_size: int = 1000) -> None:
+        if block_size <= 0:
+            raise ValueError('block_size must be positive')
+        self._lease = lease
+        self._block_size = block_size
+        self._next = self._end = 0
+        self._lock = threading.Lock()
+
+    def __call__(self) -> int:
+        with self._lock:
+            if self._next == self._end:
+                self._next = self._lease(self._block_size)
+                self._end = self._next + self._block_size
+            id = self._next
+            self._next += 1
+            return id
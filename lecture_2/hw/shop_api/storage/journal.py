@@ -0,0 +1,176 @@
+"""Operation log and snapshots that make the memory backend survive restarts.
+
+A data directory holds numbered log segments `NNNNNNNN.log` of JSON lines, one
+operation per line, and snapshots `NNNNNNNN.snapshot` of the whole state. Snapshot
+`n` holds the state after every record of the segments before `n`, so recovery
+loads the newest snapshot and replays only the segments from `n` on.
+"""
+
+import json
+import os
+import pickle
+import threading
+from typing import Any, Iterator, Optional
+
+
+def _path(directory: str, number: int, suffix: str) -> str:
+    return os.path.join(directory, f'{number:08d}.{suffix}')
+
+def _numbers(directory: str, suffix: str) -> list[int]:
+    return sorted(
+        int(name.split('.')[0]) for name in os.listdir(directory)
+        if name.endswith(f'.{suffix}') and name.split('.')[0].isdigit()
+    )
+
+def _fsync_directory(directory: str) -> None:
+    # makes created, renamed and removed files themselves durable
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def read_snapshot(directory: str) -> tuple[int, Optional[Any]]:
+    """The number and state of the newest snapshot, or `(0, None)` without one."""
+    numbers = _numbers(directory, 'snapshot')
+    if not numbers:
+        return 0, None
+    with open(_path(directory, numbers[-1], 'snapshot'), 'rb') as file:
+        return numbers[-1], pickle.load(file)
+
+def write_snapshot(directory: str, number: int, state: Any) -> None:
+    """Durably write snapshot `number`, then remove the snapshots and segments it replaces."""
+    path = _path(directory, number, 'snapshot')
+    with open(path + '.tmp', 'wb') as file:
+        pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(path + '.tmp', path)
+    _fsync_directory(directory)
+
+    for old in _numbers(directory, 'snapshot'):
+        if old < number:
+            os.remove(_path(directory, old, 'snapshot'))
+    for old in _numbers(directory, 'log'):
+        if old < number:
+            os.remove(_path(directory, old, 'log'))
+
+def read_records(directory: str, first_segment: int) -> Iterator[list]:
+    """Records of the segments from `first_segment` on, in the order they were appended.
+
+    A crash can leave the last line of a segment half written; such a line was never
+    acknowledged and is skipped.
+    """
+    for number in _numbers(directory, 'log'):
+        if number < first_segment:
+            continue
+        with open(_path(directory, number, 'log'), 'rb') as file:
+            for line in file:
+                if not line.endswith(b'\n'):
+                    break
+                yield json.loads(line)
+
+def next_segment(directory: str) -> int:
+    """A segment number after every existing file, so recovery never appends to a torn segment."""
+    return max(_numbers(directory, 'log') + _numbers(directory, 'snapshot'), default=0) + 1
+
+
+class Journal:
+    """Appends records to the current log segment with group commit.
+
+    `append` only queues a record; a background thread writes everything queued
+    so far with one write and one fsync, so concurrent writers share the cost of
+    an fsync. `wait` blocks until a record is on disk; with `sync=False` it
+    returns at once and the last records before a crash may be lost.
+    """
+
+    def __init__(self, directory: str, segment: int, sync: bool = True) -> None:
+        self.directory = directory
+        self._sync = sync
+        self._segment = segment
+        self._file = open(_path(directory, segment, 'log'), 'ab')
+        _fsync_directory(directory)
+
+        self._lock = threading.Lock()
+        self._queued = threading.Condition(self._lock)
+        self._written = threading.Condition(self._lock)
+        self._pending = list[bytes]()
+        # (segment, records queued before the rotation to it) for rotations not flushed yet
+        self._rotations = list[tuple[int, list[bytes]]]()
+        self._appended = 0
+        self._durable = 0
+        self._since_rotation = 0
+        self._closing = False
+        self._flusher = threading.Thread(target=self._flush, name='journal-flush', daemon=True)
+        self._flusher.start()
+
+    @property
+    def records_since_rotation(self) -> int:
+        return self._since_rotation
+
+    def append(self, record: tuple) -> int:
+        """Queue a record and return its ticket for `wait`."""
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode() + b'\n'
+        with self._lock:
+            self._pending.append(line)
+            self._appended += 1
+            self._since_rotation += 1
+            self._queued.notify()
+            return self._appended
+
+    def wait(self, ticket: int) -> None:
+        if self._sync:
+            with self._lock:
+                self._written.wait_for(lambda: self._durable >= ticket)
+
+    def rotate(self) -> int:
+        """Direct later records to a new segment and return its number.
+
+        Records appended before the call still go to the current segment, even if
+        the flusher only gets to them after records appended later.
+        """
+        with self._lock:
+            self._segment += 1
+            self._rotations.append((self._segment, self._pending))
+            self._pending = []
+            self._since_rotation = 0
+            self._queued.notify()
+            return self._segment
+
+    def close(self) -> None:
+        with self._lock:
+            self._closing = True
+            self._queued.notify()
+        self._flusher.join()
+        self._file.close()
+
+    def _write(self, lines: list[bytes]) -> None:
+        if lines:
+            self._file.write(b''.join(lines))
+            self._file.flush()
+            if self._sync:
+                os.fsync(self._file.fileno())
+
+    def _flush(self) -> None:
+        while True:
+            with self._lock:
+                self._queued.wait_for(lambda: self._pending or self._rotations or self._closing)
+                rotations, self._rotations = self._rotations, []
+                batch, self._pending = self._pending, []
+                ticket = self._appended
+                closing = self._closing
+
+            # each rotation splits the queue: what came before it ends the previous segment
+            for segment, lines in rotations:
+                self._write(lines)
+                self._file.close()
+                self._file = open(_path(self.directory, segment, 'log'), 'ab')
+                _fsync_directory(self.directory)
+            self._write(batch)
+
+            with self._lock:
+                self._durable = ticket
+                self._written.notify_all()
+            if closing and not batch and not rotations:
+                return
@@ -0,0 +1,720 @@
+import os
+import threading
+import time
+from collections import deque
+from bisect import bisect_left, bisect_right, insort
+from heapq import heappop, heappush, merge
+from contextlib import ExitStack, contextmanager
+from dataclasses import replace
+from itertools import count, islice
+from operator import itemgetter
+from math import fsum, inf
+from uuid import uuid4
+from typing import Iterable, Iterator, List, Optional
+from .base import Storage, cart_order
+from .entities import CartEntity, CartItemEntity, ItemEntity, ItemInfo, PatchItemInfo, StorageStats
+from .ids import IdAllocator, counter_lease
+from .journal import Journal, next_segment, read_records, read_snapshot, write_snapshot
+from .metrics import CARTS_EVICTED, observe_scan
+from .search import TokenIndex
+
+# carts a create_cart call expires or evicts at most
+_EXPIRE_PER_CREATE = 8
+# queued cart index updates past which a writer applies them itself
+_CART_INDEX_BACKLOG = 1024
+
+
+def _index_range(index: list, min_value: Optional[float], max_value: Optional[float]) -> tuple[int, int]:
+    lo = 0 if min_value is None else bisect_left(index, (min_value,))
+    hi = len(index) if max_value is None else bisect_right(index, (max_value, inf))
+    return lo, hi
+
+def _insort_many(index: list, keys: list) -> None:
+    # a few keys are cheaper to insort one by one; for many, Timsort merges the two sorted runs in linear time
+    if len(keys) < 32:
+        for key in keys:
+            insort(index, key)
+    else:
+        keys.sort()
+        index.extend(keys)
+        index.sort()
+
+def _remove_many(index: list, keys: list) -> list:
+    # like _insort_many: a few keys are deleted by bisect, many by one linear filtering pass
+    if len(keys) < 32:
+        for key in keys:
+            del index[bisect_left(index, key)]
+        return index
+    # ids are unique within an index and cheaper to hash than the keys
+    removed = {id for _, id in keys}
+    return [key for key in index if key[1] not in removed]
+
+def _keys(index: list, lo: int, hi: int) -> Iterator[tuple]:
+    return (index[i] for i in range(lo, hi))
+
+def _counted(iterable: Iterable) -> tuple[Iterator, Iterator[int]]:
+    # pairs each value with a C-level counter, so counting adds no Python step per value;
+    # next() on the returned counter afterwards is the number of values consumed
+    consumed = count()
+    return map(itemgetter(0), zip(iterable, consumed)), consumed
+
+def _between(value: float, min_value: Optional[float], max_value: Optional[float]) -> bool:
+    return (min_value is None or value >= min_value) and (max_value is None or value <= max_value)
+
+@contextmanager
+def _locked(locks: List[threading.Lock], ids: Iterable[int]) -> Iterator[None]:
+    # stripes are always taken in ascending order, so callers locking several never deadlock
+    with ExitStack() as stack:
+        for stripe in sorted({id % len(locks) for id in ids}):
+            stack.enter_context(locks[stripe])
+        yield
+
+def _copy_item(item: ItemEntity) -> ItemEntity:
+    # spelled out, as copy.copy goes through __reduce_ex__ and is several times slower
+    return ItemEntity(item.id, item.name, item.price, item.deleted, item.version)
+
+def _copy_cart(cart: CartEntity) -> CartEntity:
+    # lines are frozen and only ever replaced, so copying the list is enough
+    return replace(cart, items=list(cart.items))
+
+
+class MemoryStorage(Storage):
+    """Shop state in process memory.
+
+    Items and carts are guarded by striped locks (an entity uses lock `id % lock_stripes`),
+    so writes to different entities proceed in parallel. The sorted indexes share one
+    lock that is only held for the index update itself. Changes of cart totals, the most
+    frequent writes, do not take it at all: they are queued and moved into the cart
+    indexes in one batch by the next listing, or by a writer once the queue is long. Locks are always taken in the
+    order item stripes, cart stripes, index lock. Entities are returned as copies made
+    under their lock, never as the stored objects.
+
+    A store opened with `recover` logs every write to a journal in its data directory
+    while still holding the write's locks, so the log order matches the order writes
+    were applied in, and returns once the record is on disk. Snapshots taken with
+    every lock held bound the log to replay on the next start.
+
+    Deleted items are tombstones until compaction moves them to a cold store of plain
+    tuples with its own price index. Listings of live items then never walk past them,
+    and the carts holding them are no longer tracked, as a deleted item cannot change again.
+
+    Carts not touched (created, read or added to) for `cart_ttl` seconds expire, and past
+    `max_carts` the least recently touched carts are evicted. Both are found through a heap
+    of touch times, so no write ever scans all carts: a touch only records the new time,
+    and a stale heap entry is pushed back with it when it reaches the top.
+
+    Compaction and expiry run every `maintenance_interval` seconds if given; creating a
+    cart also expires or evicts a few of the carts that are due.
+    """
+
+    def __init__(
+        self,
+        lock_stripes: int = 64,
+        maintenance_interval: Optional[float] = None,
+        cart_ttl: Optional[float] = None,
+        max_carts: Optional[int] = None) -> None:
+        self._carts = dict[int, CartEntity]()
+        # item id -> position of its line in cart.items, for each cart
+        self._cart_lines = dict[int, dict[int, int]]()
+        self._cart_price_index = list[tuple[float, int]]()
+        self._cart_quantity_index = list[tuple[int, int]]()
+        # (id, old price, old quantity, new price, new quantity) changes of cart totals not yet in the
+        # indexes above; applied in batches by whoever next takes the index lock to read them
+        self._cart_index_updates = deque[tuple[int, float, int, float, int]]()
+        # cart id -> time of its last touch, and a heap with one (touch time, id) entry
+        # per cart whose time is never later than the recorded one
+        self._cart_touched = dict[int, float]()
+        self._cart_expiry = list[tuple[float, int]]()
+        self._expiry_lock = threading.Lock()
+        self._cart_ttl = cart_ttl
+        self._max_carts = max_carts
+        # ids of expired carts are never handed out again, also after a restart
+        self._last_cart_id = -1
+        self._items = dict[int, ItemEntity]()
+        # item id -> ids of the carts with a line for it, so item changes reach only those carts
+        self._item_carts = dict[int, set[int]]()
+        # (price, id) pairs kept sorted, so price filters are bisect range lookups
+        self._item_price_index = list[tuple[float, int]]()
+        # name tokens -> item ids, for searches by name; compacted items stay in it
+        self._item_names = TokenIndex()
+        # ids of deleted items still in _items, waiting for compaction
+        self._tombstones = set[int]()
+        # compacted items: id -> (name, price, version), and their sorted (price, id) pairs
+        self._deleted_items = dict[int, tuple[str, float, int]]()
+        self._deleted_price_index = list[tuple[float, int]]()
+
+        self._item_locks = [threading.Lock() for _ in range(lock_stripes)]
+        self._cart_locks = [threading.Lock() for _ in range(lock_stripes)]
+        # number of lines over the carts of each cart stripe, changed only under that stripe's lock
+        self._stripe_cart_lines = [0] * lock_stripes
+        self._index_lock = threading.Lock()
+
+        self.epoch = uuid4().hex[:8]
+        # every write takes a fresh number once its change is made, so a generation
+        # read before a listing stops matching as soon as a later write to what it lists lands
+        self._generations = count(1)
+        self._item_generation = 0
+        self._cart_generation = 0
+        self._cart_ids = IdAllocator(counter_lease())
+        self._item_ids = IdAllocator(counter_lease())
+
+        self._journal: Optional[Journal] = None
+        self._snapshot_lock = threading.Lock()
+        self._closed = threading.Event()
+        if maintenance_interval is not None:
+            threading.Thread(
+                target=self._maintain_periodically, args=(maintenance_interval,),
+                name='memory-storage-maintenance', daemon=True).start()
+
+    @classmethod
+    def recover(
+        cls,
+        directory: str,
+        sync: bool = True,
+        snapshot_interval: float = 60.0,
+        snapshot_records: int = 100_000,
+        **options) -> 'MemoryStorage':
+        """Restore the state persisted in `directory` and persist every later write there.
+
+        A snapshot is taken every `snapshot_interval` seconds once at least
+        `snapshot_records` writes were logged since the previous one. Other `options`
+        are passed to the constructor. Restored carts count as touched at recovery.
+        """
+        os.makedirs(directory, exist_ok=True)
+        storage = cls(**options)
+        segment, state = read_snapshot(directory)
+        if state is not None:
+            storage._load(state)
+        for record in read_records(directory, segment):
+            storage._replay(record)
+
+        storage._cart_ids = IdAllocator(counter_lease(storage._last_cart_id + 1))
+        storage._item_ids = IdAllocator(counter_lease(max(
+            max(storage._items, default=-1), max(storage._deleted_items, default=-1)) + 1))
+        storage._journal = Journal(directory, next_segment(directory), sync)
+        threading.Thread(
+            target=storage._snapshot_periodically, args=(snapshot_interval, snapshot_records),
+            name='memory-storage-snapshots', daemon=True).start()
+        return storage
+
+    def close(self) -> None:
+        self._closed.set()
+        if self._journal is not None:
+            with self._snapshot_lock:
+                self._journal.close()
+
+    def _maintain_periodically(self, interval: float) -> None:
+        while not self._closed.wait(interval):
+            self.compact()
+            self.expire_carts()
+
+    def compact(self, batch_size: int = 16) -> int:
+        """Move the tombstones of deleted items to the cold store; returns how many were moved.
+
+        Each batch locks the stripes of its items and the indexes, which stalls every read,
+        as reads of this store run on the event loop. Batches are small enough for their keys
+        to leave the price index by bisection (see `_remove_many`), a few milliseconds even with
+        a million items, where a larger batch would take a pass over the whole index.
+        """
+        tombstones = list(self._tombstones)
+        for start in range(0, len(tombstones), batch_size):
+            if start:
+                # hands over the GIL, so a thread waiting for the locks gets them between batches
+                time.sleep(0)
+            batch = tombstones[start:start + batch_size]
+            with _locked(self._item_locks, batch), self._index_lock:
+                items = [self._items[id] for id in batch]
+                keys = [(item.price, item.id) for item in items]
+                # cold copies are in place before the hot ones go, so lookups always find one
+                self._deleted_items.update((item.id, (item.name, item.price, item.version)) for item in items)
+                _insort_many(self._deleted_price_index, list(keys))
+                for id in batch:
+                    del self._items[id]
+                    self._item_carts.pop(id, None)
+                self._item_price_index = _remove_many(self._item_price_index, keys)
+                self._tombstones.difference_update(batch)
+        return len(tombstones)
+
+    def _find_item(self, id: int) -> Optional[ItemEntity]:
+        # the stored live item or tombstone, or a new entity for a compacted item
+        item = self._items.get(id)
+        if item is None and id in self._deleted_items:
+            name, price, version = self._deleted_items[id]
+            item = ItemEntity(id=id, name=name, price=price, deleted=True, version=version)
+        return item
+
+    def _snapshot_periodically(self, interval: float, records: int) -> None:
+        while not self._closed.wait(interval):
+            if self._journal.records_since_rotation >= records:
+                self.snapshot()
+
+    def snapshot(self) -> None:
+        """Persist the whole state, so that recovery only replays the log written after it."""
+        with self._snapshot_lock:
+            if self._closed.is_set():
+                return
+            # every lock stops all writers, so the state matches exactly the records logged so far
+            all_stripes = range(len(self._item_locks))
+            with _locked(self._item_locks, all_stripes), _locked(self._cart_locks, all_stripes), self._index_lock:
+                segment = self._journal.rotate()
+                state = self._dump()
+            write_snapshot(self._journal.directory, segment, state)
+
+    def _dump(self) -> dict:
+        return {
+            'items': [(item.id, item.name, item.price, item.deleted, item.version) for item in self._items.values()]
+                     + [(id, name, price, True, version) for id, (name, price, version) in self._deleted_items.items()],
+            'carts': [
+                (cart.id, cart.price, cart.quantity, cart.version,
+                 [(line.id, line.name, line.quantity, line.available) for line in cart.items])
+                for cart in self._carts.values()
+            ],
+            'last_cart_id': self._last_cart_id,
+        }
+
+    def _load(self, state: dict) -> None:
+        # deleted items go straight to the cold store
+        for id, name, price, deleted, version in state['items']:
+            if deleted:
+                self._deleted_items[id] = (name, price, version)
+            else:
+                self._items[id] = ItemEntity(id, name, price, deleted, version)
+            self._item_names.add(id, name)
+        self._item_price_index = sorted((item.price, item.id) for item in self._items.values())
+        self._deleted_price_index = sorted((price, id) for id, (_, price, _) in self._deleted_items.items())
+        for id, price, quantity, version, lines in state['carts']:
+            cart = self._carts[id] = CartEntity(id, [CartItemEntity(*line) for line in lines], price, quantity, version)
+            self._cart_lines[id] = {line.id: position for position, line in enumerate(cart.items)}
+            self._stripe_cart_lines[id % len(self._cart_locks)] += len(cart.items)
+            for line in cart.items:
+                self._item_carts.setdefault(line.id, set()).add(id)
+        self._cart_price_index = sorted((cart.price, cart.id) for cart in self._carts.values())
+        self._cart_quantity_index = sorted((cart.quantity, cart.id) for cart in self._carts.values())
+        self._last_cart_id = state['last_cart_id']
+        now = time.monotonic()
+        self._cart_touched = dict.fromkeys(self._carts, now)
+        self._cart_expiry = [(now, id) for id in sorted(self._carts)]
+
+    def _replay(self, record: list) -> None:
+        # records are replayed before the journal is opened, so they are not logged again
+        op, *args = record
+        if op == 'cart':
+            self._insert_cart(args[0])
+        elif op == 'items':
+            self._insert_items([ItemEntity(id=id, name=name, price=price) for id, name, price in args[0]])
+        elif op == 'add':
+            self.add_items_to_cart(args[0], [(item_id, quantity) for item_id, quantity in args[1]])
+        elif op == 'patch':
+            self.patch_item(args[0], PatchItemInfo(name=args[1], price=args[2]))
+        elif op == 'delete':
+            self.delete_item(args[0])
+        elif op == 'expire':
+            self._drop_cart(args[0])
+        else:
+            raise ValueError(f'Unknown journal record: {record!r}')
+
+    def _changed(self, record: tuple, items: bool, carts: bool) -> int:
+        # called with the locks of the write held, naming the listings the write changes;
+        # returns the ticket to wait for with `_persisted`
+        generation = next(self._generations)
+        if items:
+            self._item_generation = generation
+        if carts:
+            self._cart_generation = generation
+        return 0 if self._journal is None else self._journal.append(record)
+
+    def _persisted(self, ticket: int) -> None:
+        # called once the write's locks are released, so writers share one fsync
+        if self._journal is not None:
+            self._journal.wait(ticket)
+
+    @property
+    def blocking_writes(self) -> bool:
+        # journaled writes wait for their group commit's fsync
+        return self._journal is not None
+
+    def get_item_generation(self) -> int:
+        return self._item_generation
+
+    def get_cart_generation(self) -> int:
+        return self._cart_generation
+
+    def get_stats(self) -> StorageStats:
+        # the dicts are only read, each with a single C call, so no lock is needed
+        tombstones = len(self._tombstones)
+        return StorageStats(
+            items=len(self._items) - tombstones,
+            deleted_items=tombstones + len(self._deleted_items),
+            tombstones=tombstones,
+            carts=len(self._carts),
+            cart_lines=sum(self._stripe_cart_lines))
+
+    def _insert_cart(self, id: int) -> CartEntity:
+        cart = CartEntity(id=id)
+        self._cart_lines[id] = {}
+        self._carts[id] = cart
+        touched = self._cart_touched[id] = time.monotonic()
+        with self._index_lock:
+            insort(self._cart_price_index, (cart.price, id))
+            insort(self._cart_quantity_index, (cart.quantity, id))
+            self._last_cart_id = max(self._last_cart_id, id)
+        with self._expiry_lock:
+            heappush(self._cart_expiry, (touched, id))
+        return cart
+
+    def _drop_cart(self, id: int) -> None:
+        # called with the cart's stripe and the stripes of its items held
+        with self._index_lock:
+            # the cart's queued updates go first, so the indexes hold its current keys
+            self._apply_cart_index_updates()
+            # listings look up every id they find in the indexes, so the cart leaves both together
+            cart = self._carts.pop(id)
+            del self._cart_price_index[bisect_left(self._cart_price_index, (cart.price, id))]
+            del self._cart_quantity_index[bisect_left(self._cart_quantity_index, (cart.quantity, id))]
+        lines = self._cart_lines.pop(id)
+        self._stripe_cart_lines[id % len(self._cart_locks)] -= len(lines)
+        for item_id in lines:
+            carts = self._item_carts.get(item_id)
+            if carts is not None:
+                carts.discard(id)
+                if not carts:
+                    del self._item_carts[item_id]
+        del self._cart_touched[id]
+
+    def _expire_cart(self, id: int, touched: float) -> Optional[int]:
+        # removes the cart unless it was touched after `touched`; returns the ticket of its record if removed
+        while True:
+            item_ids = list(self._cart_lines.get(id, ()))
+            with _locked(self._item_locks, item_ids), _locked(self._cart_locks, [id]):
+                if self._cart_touched.get(id) != touched:
+                    return None
+                if not self._cart_lines[id].keys() <= set(item_ids):
+                    # lines were added before the locks were taken; lock their items as well
+                    continue
+                self._drop_cart(id)
+                return self._changed(('expire', id), items=False, carts=True)
+
+    def expire_carts(self, limit: Optional[int] = None) -> int:
+        """Remove carts idle for longer than the TTL, then the least recently touched ones
+        past the cap, at most `limit` of them; returns how many were removed."""
+        if self._cart_ttl is None and self._max_carts is None:
+            return 0
+        deadline = -inf if self._cart_ttl is None else time.monotonic() - self._cart_ttl
+        removed, ticket = 0, 0
+        while limit is None or removed < limit:
+            with self._expiry_lock:
+                if not self._cart_expiry:
+                    break
+                touched, id = self._cart_expiry[0]
+                expired = touched <= deadline
+                if not expired and (self._max_carts is None or len(self._carts) <= self._max_carts):
+                    break
+                heappop(self._cart_expiry)
+                last_touched = self._cart_touched.get(id)
+                if last_touched is None:
+                    continue
+                if last_touched != touched:
+                    heappush(self._cart_expiry, (last_touched, id))
+                    continue
+
+            cart_ticket = self._expire_cart(id, touched)
+            if cart_ticket is not None:
+                ticket = cart_ticket
+                removed += 1
+                CARTS_EVICTED.labels('ttl' if expired else 'cap').inc()
+            else:
+                with self._expiry_lock:
+                    # touched in the meantime: back into the heap with its new time
+                    if id in self._cart_touched:
+                        heappush(self._cart_expiry, (self._cart_touched[id], id))
+        # tickets are durable in order, so waiting for the last record covers every one logged here
+        self._persisted(ticket)
+        return removed
+
+    def create_cart(self) -> CartEntity:
+        id = self._cart_ids()
+        with self._cart_locks[id % len(self._cart_locks)]:
+            cart = _copy_cart(self._insert_cart(id))
+            ticket = self._changed(('cart', id), items=False, carts=True)
+        self._persisted(ticket)
+        # a bounded share, so a backlog of due carts never lands on one request; maintenance removes the rest
+        self.expire_carts(_EXPIRE_PER_CREATE)
+        return cart
+
+    def get_cart(self, id: int) -> Optional[CartEntity]:
+        with self._cart_locks[id % len(self._cart_locks)]:
+            cart = self._carts.get(id)
+            if cart is None:
+                return None
+            self._cart_touched[id] = time.monotonic()
+            return _copy_cart(cart)
+
+    def _peek_cart(self, id: int) -> Optional[CartEntity]:
+        # a copy for listings, which do not count as touching the cart
+        cart = self._carts.get(id)
+        if cart is None:
+            return None
+        with self._cart_locks[id % len(self._cart_locks)]:
+            return _copy_cart(cart)
+
+    def get_cart_version(self, id: int) -> Optional[int]:
+        # a conditional GET answered from the version alone still reads the cart, so it touches it too
+        with self._cart_locks[id % len(self._cart_locks)]:
+            cart = self._carts.get(id)
+            if cart is None:
+                return None
+            self._cart_touched[id] = time.monotonic()
+            return cart.version
+
+    def get_carts(
+        self,
+        offset: int,
+        limit: int,
+        min_price: Optional[float],
+        max_price: Optional[float],
+        min_quantity: Optional[int],
+        max_quantity: Optional[int],
+        after: Optional[tuple[float, int]] = None) -> List[CartEntity]:
+        with self._index_lock:
+            self._apply_cart_index_updates()
+            ids, scanned, matched = self._find_carts(
+                offset, limit, min_price, max_price, min_quantity, max_quantity, after)
+        observe_scan('get_carts', scanned, matched)
+        return [cart for cart in map(self._peek_cart, ids) if cart is not None]
+
+    def _find_carts(
+        self,
+        offset: int,
+        limit: int,
+        min_price: Optional[float],
+        max_price: Optional[float],
+        min_quantity: Optional[int],
+        max_quantity: Optional[int],
+        after: Optional[tuple[float, int]]) -> tuple[List[int], int, int]:
+        # returns the ids with the numbers of visited and of matching index entries
+        index = self._cart_price_index
+        lo, hi = _index_range(self._cart_price_index, min_price, max_price)
+        q_lo, q_hi = _index_range(self._cart_quantity_index, min_quantity, max_quantity)
+
+        if cart_order(min_price, max_price, min_quantity, max_quantity) == 'quantity':
+            index, lo, hi = self._cart_quantity_index, q_lo, q_hi
+        elif q_hi - q_lo < hi - lo:
+            # fewer carts match the quantity bounds: collect those and order them by price here
+            keys = sorted(
+                key for key in ((self._carts[id].price, id) for _, id in self._cart_quantity_index[q_lo:q_hi])
+                if _between(key[0], min_price, max_price) and (after is None or key > after))
+            return [id for _, id in keys[offset:offset + limit]], q_hi - q_lo, len(keys)
+
+        if after is not None:
+            lo = max(lo, bisect_right(index, after))
+
+        # walk the range of the index and check the other bounds per cart in O(1)
+        ids, scanned = _counted(index[i][1] for i in range(lo, hi))
+        ids, matched = _counted(id for id in ids if _between(self._carts[id].price, min_price, max_price)
+                                and _between(self._carts[id].quantity, min_quantity, max_quantity))
+        return list(islice(ids, offset, offset + limit)), next(scanned), next(matched)
+
+    def add_items_to_cart(self, cart_id: int, lines: List[tuple[int, int]]) -> CartEntity:
+        with _locked(self._item_locks, (item_id for item_id, _ in lines)), _locked(self._cart_locks, [cart_id]):
+            cart = self._carts.get(cart_id)
+            items = [self._items.get(item_id) for item_id, _ in lines]
+            if cart is None or any(item is None or item.deleted for item in items):
+                raise ValueError
+
+            quantity = 0
+            cart_lines = self._cart_lines[cart.id]
+            for item, (_, item_quantity) in zip(items, lines):
+                position = cart_lines.get(item.id)
+                if position is not None:
+                    cart_item = cart.items[position]
+                    cart.items[position] = replace(cart_item, quantity=cart_item.quantity + item_quantity)
+                else:
+                    cart_lines[item.id] = len(cart.items)
+                    cart.items.append(CartItemEntity(id=item.id, name=item.name, quantity=item_quantity))
+                    self._stripe_cart_lines[cart_id % len(self._cart_locks)] += 1
+                    self._item_carts.setdefault(item.id, set()).add(cart.id)
+                quantity += item_quantity
+
+            self._set_cart_totals(cart, self._cart_price(cart), cart.quantity + quantity)
+            cart.version += 1
+            self._cart_touched[cart_id] = time.monotonic()
+            ticket = self._changed(('add', cart_id, lines), items=False, carts=True)
+            cart = _copy_cart(cart)
+        self._persisted(ticket)
+        return cart
+
+    def _set_cart_totals(self, cart: CartEntity, price: float, quantity: int) -> None:
+        # called with the cart's stripe held, which keeps the cart's queued updates in order
+        if price == cart.price and quantity == cart.quantity:
+            return
+        self._cart_index_updates.append((cart.id, cart.price, cart.quantity, price, quantity))
+        cart.price, cart.quantity = price, quantity
+        if len(self._cart_index_updates) >= _CART_INDEX_BACKLOG and self._index_lock.acquire(blocking=False):
+            # nobody is listing carts; a writer that finds the lock taken leaves the backlog to its holder
+            try:
+                self._apply_cart_index_updates()
+            finally:
+                self._index_lock.release()
+
+    def _apply_cart_index_updates(self) -> None:
+        # called with the index lock held; only the first old and the last new key of each cart count
+        changes = dict[int, list]()
+        while self._cart_index_updates:
+            id, old_price, old_quantity, price, quantity = self._cart_index_updates.popleft()
+            change = changes.setdefault(id, [old_price, old_quantity, price, quantity])
+            change[2:] = price, quantity
+        if not changes:
+            return
+        moved = [(id, *change) for id, change in changes.items() if change[0] != change[2]]
+        self._cart_price_index = _remove_many(self._cart_price_index, [(old, id) for id, old, _, _, _ in moved])
+        _insort_many(self._cart_price_index, [(new, id) for id, _, _, new, _ in moved])
+        moved = [(id, *change) for id, change in changes.items() if change[1] != change[3]]
+        self._cart_quantity_index = _remove_many(self._cart_quantity_index, [(old, id) for id, _, old, _, _ in moved])
+        _insort_many(self._cart_quantity_index, [(new, id) for id, _, _, _, new in moved])
+
+    def _cart_price(self, cart: CartEntity) -> float:
+        # summed over the lines on every change instead of adjusted by deltas, so rounding errors
+        # never accumulate; fsum rounds once, so the total does not depend on the order of the lines.
+        # Available lines are of live items, which are always in _items
+        return fsum(self._items[line.id].price * line.quantity for line in cart.items if line.available)
+
+    def _update_cart_lines(self, item: ItemEntity, repriced: bool) -> None:
+        # propagate an item change to the lines holding it, repricing only the carts that contain it;
+        # called with the item's stripe held, which also guards its entry in _item_carts
+        cart_ids = list(self._item_carts.get(item.id, ()))
+        with _locked(self._cart_locks, cart_ids):
+            for cart_id in cart_ids:
+                cart = self._carts[cart_id]
+                position = self._cart_lines[cart_id][item.id]
+                cart.items[position] = replace(cart.items[position], name=item.name, available=not item.deleted)
+                if repriced:
+                    self._set_cart_totals(cart, self._cart_price(cart), cart.quantity)
+                cart.version += 1
+
+    def _index_item_price(self, item: ItemEntity) -> None:
+        insort(self._item_price_index, (item.price, item.id))
+
+    def _unindex_item_price(self, item: ItemEntity) -> None:
+        del self._item_price_index[bisect_left(self._item_price_index, (item.price, item.id))]
+
+    def _insert_items(self, items: List[ItemEntity]) -> None:
+        self._items.update((item.id, item) for item in items)
+        with self._index_lock:
+            _insort_many(self._item_price_index, [(item.price, item.id) for item in items])
+            for item in items:
+                self._item_names.add(item.id, item.name)
+
+    def create_item(self, info: ItemInfo) -> ItemEntity:
+        return self.create_items([info])[0]
+
+    def create_items(self, infos: List[ItemInfo]) -> List[ItemEntity]:
+        items = [ItemEntity(id=self._item_ids(), name=info.name, price=info.price) for info in infos]
+        with _locked(self._item_locks, (item.id for item in items)):
+            self._insert_items(items)
+            ticket = self._changed(
+                ('items', [(item.id, item.name, item.price) for item in items]), items=True, carts=False)
+            copies = [_copy_item(item) for item in items]
+        self._persisted(ticket)
+        return copies
+
+    def get_item(self, id: int) -> Optional[ItemEntity]:
+        item = self._items.get(id)
+        if item is None:
+            return self._find_item(id)
+        with self._item_locks[id % len(self._item_locks)]:
+            return _copy_item(item)
+
+    def get_item_version(self, id: int) -> Optional[int]:
+        # compacted items are deleted, so only the hot store can hold a live one
+        item = self._items.get(id)
+        return None if item is None or item.deleted else item.version
+
+    def get_items(
+        self,
+        offset: int,
+        limit: int,
+        min_price: Optional[float],
+        max_price: Optional[float],
+        show_deleted: bool,
+        after: Optional[tuple[float, int]] = None,
+        query: Optional[List[str]] = None) -> List[ItemEntity]:
+        # only the matching slice of the index is visited
+        # and iteration stops as soon as offset + limit matches were found
+        with self._index_lock:
+            lo, hi = _index_range(self._item_price_index, min_price, max_price)
+            if after is not None:
+                lo = max(lo, bisect_right(self._item_price_index, after))
+            keys, size = _keys(self._item_price_index, lo, hi), hi - lo
+            if show_deleted and self._deleted_price_index:
+                # compacted items have their own index, merged into the same order
+                d_lo, d_hi = _index_range(self._deleted_price_index, min_price, max_price)
+                if after is not None:
+                    d_lo = max(d_lo, bisect_right(self._deleted_price_index, after))
+                keys, size = merge(keys, _keys(self._deleted_price_index, d_lo, d_hi)), size + d_hi - d_lo
+
+            found = None if query is None else self._item_names.search(query)
+            # walking the range finds offset + limit matches after about (offset + limit) * range / matches
+            # steps; when sorting the matches is cheaper than that, order them here instead
+            walked = None
+            if found is not None and len(found) ** 2 < (offset + limit) * size:
+                keys = (key for key in sorted((self._find_item(id).price, id) for id in found)
+                        if _between(key[0], min_price, max_price) and (after is None or key > after))
+            else:
+                keys, walked = _counted(keys)
+                if found is not None:
+                    keys = (key for key in keys if key[1] in found)
+            ids = (id for _, id in keys)
+            if not show_deleted:
+                ids = (id for id in ids if not self._find_item(id).deleted)
+            ids, matched = _counted(ids)
+            ids = list(islice(ids, offset, offset + limit))
+        # sorting looks up every match of the query
+        observe_scan('get_items', len(found) if walked is None else next(walked), next(matched))
+        return [item for item in map(self.get_item, ids) if item is not None]
+
+    def patch_item(self, id: int, patch_info: PatchItemInfo) -> ItemEntity:
+        with self._item_locks[id % len(self._item_locks)]:
+            item = self._items.get(id)
+            if item is None or item.deleted:
+                raise ValueError
+
+            repriced = False
+            if patch_info.name is not None and patch_info.name != item.name:
+                with self._index_lock:
+                    self._item_names.remove(item.id, item.name)
+                    item.name = patch_info.name
+                    self._item_names.add(item.id, item.name)
+            if patch_info.price is not None and patch_info.price != item.price:
+                repriced = True
+                with self._index_lock:
+                    self._unindex_item_price(item)
+                    item.price = patch_info.price
+                    self._index_item_price(item)
+            item.version += 1
+            self._update_cart_lines(item, repriced)
+            ticket = self._changed(('patch', id, patch_info.name, patch_info.price), items=True, carts=True)
+            item = _copy_item(item)
+        self._persisted(ticket)
+        return item
+
+    def delete_item(self, id: int) -> ItemEntity:
+        with self._item_locks[id % len(self._item_locks)]:
+            item = self._items.get(id)
+            if item is None:
+                if id not in self._deleted_items:
+                    raise ValueError
+                name, price, version = self._deleted_items[id]
+                self._deleted_items[id] = (name, price, version + 1)
+                ticket = self._changed(('delete', id), items=True, carts=True)
+                item = ItemEntity(id=id, name=name, price=price, deleted=True, version=version + 1)
+            else:
+                if not item.deleted:
+                    item.deleted = True
+                    self._tombstones.add(id)
+                    # a deleted item stays in carts as an unavailable line that no longer counts towards the price
+                    self._update_cart_lines(item, repriced=True)
+                item.version += 1
+                ticket = self._changed(('delete', id), items=True, carts=True)
+                item = _copy_item(item)
+        self._persisted(ticket)
+        return item
@@ -0,0 +1,54 @@
+from math import inf
+from typing import Callable, Iterator
+from prometheus_client import Counter, Histogram
+from prometheus_client.core import GaugeMetricFamily, Metric
+from prometheus_client.registry import Collector
+from .entities import StorageStats
+
+# registered in the default registry, which the Instrumentator exposes on /metrics
+CARTS_EVICTED = Counter(
+    'shop_carts_evicted_total', 'Carts removed by the memory store, by reason (ttl or cap)', ['reason'])
+
+# storage calls take microseconds to milliseconds, far below the default buckets
+STORAGE_CALL_SECONDS = Histogram(
+    'shop_storage_call_seconds', 'Time spent in storage functions', ['function'],
+    buckets=(1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 1.0))
+
+# a listing that visits many entries to return a page is scan amplification; a growing
+# count with a falling selectivity usually means a filter stopped using its index
+STORAGE_SCANNED = Histogram(
+    'shop_storage_scanned_entities', 'Index entries visited by a listing call', ['function'],
+    buckets=(1, 10, 100, 1_000, 10_000, 100_000, 1_000_000, inf))
+STORAGE_SELECTIVITY = Histogram(
+    'shop_storage_filter_selectivity', 'Fraction of the visited entries that matched the filters', ['function'],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 0.75, 1.0))
+
+
+def observe_scan(function: str, scanned: int, matched: int) -> None:
+    STORAGE_SCANNED.labels(function).observe(scanned)
+    if scanned:
+        STORAGE_SELECTIVITY.labels(function).observe(matched / scanned)
+
+
+class StatsCollector(Collector):
+    """Exports the sizes of the store, read once per scrape from `stats`."""
+
+    def __init__(self, stats: Callable[[], StorageStats]) -> None:
+        self._stats = stats
+
+    def describe(self) -> Iterator[Metric]:
+        # lets the registry check names without reading the store at registration
+        yield GaugeMetricFamily('shop_storage_entities', 'Entities in the store, by kind', labels=['kind'])
+        yield GaugeMetricFamily('shop_storage_cart_lines_average', 'Average number of lines per cart')
+
+    def collect(self) -> Iterator[Metric]:
+        stats = self._stats()
+        entities = GaugeMetricFamily('shop_storage_entities', 'Entities in the store, by kind', labels=['kind'])
+        entities.add_metric(['items'], stats.items)
+        entities.add_metric(['deleted_items'], stats.deleted_items)
+        entities.add_metric(['tombstones'], stats.tombstones)
+        entities.add_metric(['carts'], stats.carts)
+        yield entities
+        yield GaugeMetricFamily(
+            'shop_storage_cart_lines_average', 'Average number of lines per cart',
+            value=stats.cart_lines / stats.carts if stats.carts else 0.0)
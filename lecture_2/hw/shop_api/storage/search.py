@@ -0,0 +1,56 @@
+import re
+from bisect import bisect_left, insort
+from typing import Iterable, List, Set
+
+# runs of letters and digits; underscores separate tokens, as in SQLite's unicode61 tokenizer
+_TOKEN = re.compile(r'[^\W_]+')
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(text.lower())
+
+
+class TokenIndex:
+    """Inverted index from name tokens to ids, with prefix lookups.
+
+    Distinct tokens are kept sorted, so the tokens starting with a prefix are one
+    bisect range and a lookup touches only matching postings, never every name.
+    """
+
+    def __init__(self) -> None:
+        self._postings = dict[str, set[int]]()
+        self._tokens = list[str]()
+
+    def add(self, id: int, text: str) -> None:
+        for token in set(tokenize(text)):
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = set()
+                insort(self._tokens, token)
+            postings.add(id)
+
+    def remove(self, id: int, text: str) -> None:
+        for token in set(tokenize(text)):
+            postings = self._postings[token]
+            postings.discard(id)
+            if not postings:
+                del self._postings[token]
+                del self._tokens[bisect_left(self._tokens, token)]
+
+    def _prefixed(self, prefix: str) -> Set[int]:
+        ids = set()
+        for i in range(bisect_left(self._tokens, prefix), len(self._tokens)):
+            if not self._tokens[i].startswith(prefix):
+                break
+            ids |= self._postings[self._tokens[i]]
+        return ids
+
+    def search(self, prefixes: Iterable[str]) -> Set[int]:
+        """Ids whose text has, for every prefix, a token starting with it."""
+        ids = None
+        # longer prefixes match fewer tokens, so the intersection shrinks fastest this way
+        for prefix in sorted(set(prefixes), key=len, reverse=True):
+            ids = self._prefixed(prefix) if ids is None else ids & self._prefixed(prefix)
+            if not ids:
+                break
+        return ids or set()
@@ -0,0 +1,360 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+from .base import Storage, cart_order
+from .entities import CartEntity, CartItemEntity, ItemEntity, ItemInfo, PatchItemInfo, StorageStats
+from .ids import IdAllocator
+
+# every patch sets the name column, if only to itself, so the trigger checks that the name changed
+_CREATE_ITEMS_FTS_UPDATE = '''CREATE TRIGGER IF NOT EXISTS items_fts_update AFTER UPDATE OF name ON items WHEN old.name IS NOT new.name BEGIN
+    INSERT INTO items_fts (items_fts, rowid, name) VALUES ('delete', old.id, old.name);
+    INSERT INTO items_fts (rowid, name) VALUES (new.id, new.name);
+END;'''
+
+_SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    price REAL NOT NULL,
+    deleted INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS items_price ON items (price, id);
+CREATE INDEX IF NOT EXISTS items_live_price ON items (price, id) WHERE deleted = 0;
+
+-- full-text index over item names, kept in sync with the items table by triggers;
+-- diacritics are kept, matching search.tokenize
+CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+    name, content = 'items', content_rowid = 'id', tokenize = 'unicode61 remove_diacritics 0'
+);
+CREATE TRIGGER IF NOT EXISTS items_fts_insert AFTER INSERT ON items BEGIN
+    INSERT INTO items_fts (rowid, name) VALUES (new.id, new.name);
+END;
+{_CREATE_ITEMS_FTS_UPDATE}
+
+CREATE TABLE IF NOT EXISTS carts (
+    id INTEGER PRIMARY KEY,
+    price REAL NOT NULL DEFAULT 0,
+    quantity INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS carts_price ON carts (price, id);
+CREATE INDEX IF NOT EXISTS carts_quantity ON carts (quantity, id);
+
+CREATE TABLE IF NOT EXISTS cart_items (
+    line INTEGER PRIMARY KEY,
+    cart_id INTEGER NOT NULL REFERENCES carts (id),
+    item_id INTEGER NOT NULL REFERENCES items (id),
+    name TEXT NOT NULL,
+    quantity INTEGER NOT NULL DEFAULT 1,
+    available INTEGER NOT NULL DEFAULT 1,
+    UNIQUE (cart_id, item_id)
+);
+CREATE INDEX IF NOT EXISTS cart_items_item ON cart_items (item_id);
+
+CREATE TABLE IF NOT EXISTS sequences (
+    name TEXT PRIMARY KEY,
+    next INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO sequences VALUES ('carts', (SELECT coalesce(max(id) + 1, 0) FROM carts));
+INSERT OR IGNORE INTO sequences VALUES ('items', (SELECT coalesce(max(id) + 1, 0) FROM items));
+-- bumped by every transaction that changes what item or cart listings show
+INSERT OR IGNORE INTO sequences VALUES ('item_generation', 0);
+INSERT OR IGNORE INTO sequences VALUES ('cart_generation', 0);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+INSERT OR IGNORE INTO meta VALUES ('epoch', lower(hex(randomblob(4))));
+'''
+
+# statements are module constants so that every call reuses the connection's prepared statement cache
+_LEASE_IDS = 'UPDATE sequences SET next = next + ? WHERE name = ? RETURNING next'
+_INSERT_CART = 'INSERT INTO carts (id) VALUES (?)'
+_SELECT_EPOCH = "SELECT value FROM meta WHERE key = 'epoch'"
+_HAS_ITEMS_FTS = "SELECT 1 FROM sqlite_master WHERE name = 'items_fts'"
+_REBUILD_ITEMS_FTS = "INSERT INTO items_fts (items_fts) VALUES ('rebuild')"
+_SELECT_ITEMS_FTS_UPDATE = "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'items_fts_update'"
+_DROP_ITEMS_FTS_UPDATE = 'DROP TRIGGER items_fts_update'
+_BUMP_GENERATION = 'UPDATE sequences SET next = next + 1 WHERE name = ?'
+_SELECT_GENERATION = 'SELECT next FROM sequences WHERE name = ?'
+_SELECT_STATS = '''
+SELECT
+    (SELECT count(*) FROM items WHERE deleted = 0),
+    (SELECT count(*) FROM items WHERE deleted = 1),
+    (SELECT count(*) FROM carts),
+    (SELECT count(*) FROM cart_items)
+'''
+_SELECT_CART = 'SELECT id, price, quantity, version FROM carts WHERE id = ?'
+_SELECT_CART_VERSION = 'SELECT version FROM carts WHERE id = ?'
+_SELECT_CART_LINES = 'SELECT item_id, name, quantity, available FROM cart_items WHERE cart_id = ? ORDER BY line'
+_UPSERT_CART_LINE = '''
+INSERT INTO cart_items (cart_id, item_id, name, quantity) VALUES (?, ?, ?, ?)
+ON CONFLICT (cart_id, item_id) DO UPDATE SET quantity = quantity + excluded.quantity
+'''
+# a cart's price is summed over its available lines on every change instead of adjusted by deltas,
+# so rounding errors never accumulate
+_CART_PRICE = '''
+coalesce((
+    SELECT sum(items.price * cart_items.quantity) FROM cart_items JOIN items ON items.id = cart_items.item_id
+    WHERE cart_items.cart_id = carts.id AND cart_items.available = 1
+), 0.0)
+'''
+_UPDATE_CART_TOTALS = f'UPDATE carts SET price = {_CART_PRICE}, quantity = quantity + ?, version = version + 1 WHERE id = ?'
+_INSERT_ITEM = 'INSERT INTO items (id, name, price) VALUES (?, ?, ?) RETURNING id, name, price, deleted, version'
+_INSERT_ITEMS = 'INSERT INTO items (id, name, price) VALUES (?, ?, ?)'
+_SELECT_ITEM = 'SELECT id, name, price, deleted, version FROM items WHERE id = ?'
+_SELECT_ITEM_VERSION = 'SELECT version FROM items WHERE id = ? AND deleted = 0'
+_PATCH_ITEM = '''
+UPDATE items SET name = coalesce(?, name), price = coalesce(?, price), version = version + 1
+WHERE id = ? AND deleted = 0 RETURNING id, name, price, deleted, version
+'''
+_DELETE_ITEM = 'UPDATE items SET deleted = 1, version = version + 1 WHERE id = ? RETURNING id, name, price, deleted, version'
+# propagate an item change to the carts holding it, found through the cart_items_item index
+_UPDATE_ITEM_LINES = 'UPDATE cart_items SET name = ?, available = ? WHERE item_id = ?'
+_UPDATE_ITEM_CARTS = f'''
+UPDATE carts SET price = {_CART_PRICE}, version = version + 1
+WHERE id IN (SELECT cart_id FROM cart_items WHERE item_id = ?)
+'''
+
+
+def _bounds(column: str, min_value: Optional[float], max_value: Optional[float]) -> tuple[list[str], list]:
+    clauses, params = [], []
+    if min_value is not None:
+        clauses.append(f'{column} >= ?')
+        params.append(min_value)
+    if max_value is not None:
+        clauses.append(f'{column} <= ?')
+        params.append(max_value)
+    return clauses, params
+
+def _fetch_one(cursor: sqlite3.Cursor) -> Optional[tuple]:
+    # drain the cursor so that no statement is left running when the transaction commits
+    rows = cursor.fetchall()
+    return rows[0] if rows else None
+
+def _match_prefixes(tokens: List[str]) -> str:
+    # an FTS5 query matching rows with a token starting with each of `tokens`
+    return ' '.join('"{}"*'.format(token.replace('"', '""')) for token in tokens)
+
+def _item(row: tuple) -> ItemEntity:
+    return ItemEntity(id=row[0], name=row[1], price=row[2], deleted=bool(row[3]), version=row[4])
+
+
+class SQLiteStorage(Storage):
+    """Shop state in a SQLite database shared by every worker process opening the same file.
+
+    Each thread gets its own connection; the database runs in WAL mode, so readers
+    never wait for the single writer. Ids come from per-table sequences leased in
+    blocks of `id_block_size`, so inserts from different workers don't contend on them.
+    """
+
+    blocking_reads = True
+    blocking_writes = True
+
+    def __init__(self, path: str, id_block_size: int = 1000) -> None:
+        self._path = path
+        self._local = threading.local()
+        indexed = _fetch_one(self._conn().execute(_HAS_ITEMS_FTS)) is not None
+        self._conn().executescript(_SCHEMA)
+        if not indexed:
+            # a database from before the full-text index gets its existing names indexed once
+            self._conn().execute(_REBUILD_ITEMS_FTS)
+        if ' WHEN ' not in _fetch_one(self._conn().execute(_SELECT_ITEMS_FTS_UPDATE))[0]:
+            # a trigger from before it checked the name is replaced in one transaction, so no write misses both
+            with self._transaction() as conn:
+                conn.execute(_DROP_ITEMS_FTS_UPDATE)
+                conn.execute(_CREATE_ITEMS_FTS_UPDATE)
+        self.epoch = _fetch_one(self._conn().execute(_SELECT_EPOCH))[0]
+        self._cart_ids = IdAllocator(lambda size: self._lease_ids('carts', size), id_block_size)
+        self._item_ids = IdAllocator(lambda size: self._lease_ids('items', size), id_block_size)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, isolation_level=None, cached_statements=256)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            conn.execute('PRAGMA foreign_keys = ON')
+            conn.execute('PRAGMA busy_timeout = 5000')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self, items: bool = False, carts: bool = False) -> Iterator[sqlite3.Connection]:
+        # `items` and `carts` name the listings the transaction changes, whose generations it bumps
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if items:
+                conn.execute(_BUMP_GENERATION, ('item_generation',))
+            if carts:
+                conn.execute(_BUMP_GENERATION, ('cart_generation',))
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    @contextmanager
+    def _read(self) -> Iterator[sqlite3.Connection]:
+        # a deferred transaction: every statement in it reads the same snapshot of the database,
+        # so rows read by several statements (a cart and its lines) are consistent with each other
+        conn = self._conn()
+        conn.execute('BEGIN')
+        try:
+            yield conn
+        finally:
+            conn.execute('COMMIT')
+
+    def _lease_ids(self, sequence: str, size: int) -> int:
+        with self._transaction() as conn:
+            return _fetch_one(conn.execute(_LEASE_IDS, (size, sequence)))[0] - size
+
+    def _load_carts(self, conn: sqlite3.Connection, rows: list[tuple]) -> List[CartEntity]:
+        # called in the transaction the rows were read in, so the lines match them
+        return [
+            CartEntity(id=id, price=price, quantity=quantity, version=version, items=[
+                CartItemEntity(id=item_id, name=name, quantity=line_quantity, available=bool(available))
+                for item_id, name, line_quantity, available in conn.execute(_SELECT_CART_LINES, (id,))
+            ])
+            for id, price, quantity, version in rows
+        ]
+
+    def create_cart(self) -> CartEntity:
+        cart = CartEntity(id=self._cart_ids())
+        with self._transaction(carts=True) as conn:
+            conn.execute(_INSERT_CART, (cart.id,))
+        return cart
+
+    def get_item_generation(self) -> int:
+        return _fetch_one(self._conn().execute(_SELECT_GENERATION, ('item_generation',)))[0]
+
+    def get_cart_generation(self) -> int:
+        return _fetch_one(self._conn().execute(_SELECT_GENERATION, ('cart_generation',)))[0]
+
+    def get_stats(self) -> StorageStats:
+        items, deleted_items, carts, cart_lines = _fetch_one(self._conn().execute(_SELECT_STATS))
+        # deleted rows stay in the table and in the items_price index used by listings with show_deleted
+        return StorageStats(
+            items=items, deleted_items=deleted_items, tombstones=deleted_items, carts=carts, cart_lines=cart_lines)
+
+    def get_cart(self, id: int) -> Optional[CartEntity]:
+        with self._read() as conn:
+            carts = self._load_carts(conn, conn.execute(_SELECT_CART, (id,)).fetchall())
+        return carts[0] if carts else None
+
+    def get_cart_version(self, id: int) -> Optional[int]:
+        row = _fetch_one(self._conn().execute(_SELECT_CART_VERSION, (id,)))
+        return None if row is None else row[0]
+
+    def get_carts(
+        self,
+        offset: int,
+        limit: int,
+        min_price: Optional[float],
+        max_price: Optional[float],
+        min_quantity: Optional[int],
+        max_quantity: Optional[int],
+        after: Optional[tuple[float, int]] = None) -> List[CartEntity]:
+        order = cart_order(min_price, max_price, min_quantity, max_quantity)
+        price_clauses, price_params = _bounds('price', min_price, max_price)
+        quantity_clauses, quantity_params = _bounds('quantity', min_quantity, max_quantity)
+        clauses, params = price_clauses + quantity_clauses, price_params + quantity_params
+        if after is not None:
+            clauses.append(f'({order}, id) > (?, ?)')
+            params.extend(after)
+        where = ' AND '.join(clauses) or '1'
+
+        with self._read() as conn:
+            rows = conn.execute(
+                f'SELECT id, price, quantity, version FROM carts WHERE {where} ORDER BY {order}, id LIMIT ? OFFSET ?',
+                (*params, limit, offset)).fetchall()
+            return self._load_carts(conn, rows)
+
+    def add_items_to_cart(self, cart_id: int, lines: List[tuple[int, int]]) -> CartEntity:
+        with self._transaction(carts=True) as conn:
+            if _fetch_one(conn.execute(_SELECT_CART, (cart_id,))) is None:
+                raise ValueError
+            items = {}
+            for item_id, _ in lines:
+                if item_id not in items:
+                    items[item_id] = _fetch_one(conn.execute(_SELECT_ITEM, (item_id,)))
+                    if items[item_id] is None or items[item_id][3]:
+                        raise ValueError
+
+            conn.executemany(_UPSERT_CART_LINE, [
+                (cart_id, item_id, items[item_id][1], quantity) for item_id, quantity in lines
+            ])
+            conn.execute(_UPDATE_CART_TOTALS, (sum(quantity for _, quantity in lines), cart_id))
+            return self._load_carts(conn, conn.execute(_SELECT_CART, (cart_id,)).fetchall())[0]
+
+    def create_item(self, info: ItemInfo) -> ItemEntity:
+        id = self._item_ids()
+        with self._transaction(items=True) as conn:
+            return _item(_fetch_one(conn.execute(_INSERT_ITEM, (id, info.name, info.price))))
+
+    def create_items(self, infos: List[ItemInfo]) -> List[ItemEntity]:
+        items = [ItemEntity(id=self._item_ids(), name=info.name, price=info.price) for info in infos]
+        with self._transaction(items=True) as conn:
+            conn.executemany(_INSERT_ITEMS, [(item.id, item.name, item.price) for item in items])
+        return items
+
+    def get_item(self, id: int) -> Optional[ItemEntity]:
+        row = _fetch_one(self._conn().execute(_SELECT_ITEM, (id,)))
+        return None if row is None else _item(row)
+
+    def get_item_version(self, id: int) -> Optional[int]:
+        row = _fetch_one(self._conn().execute(_SELECT_ITEM_VERSION, (id,)))
+        return None if row is None else row[0]
+
+    def get_items(
+        self,
+        offset: int,
+        limit: int,
+        min_price: Optional[float],
+        max_price: Optional[float],
+        show_deleted: bool,
+        after: Optional[tuple[float, int]] = None,
+        query: Optional[List[str]] = None) -> List[ItemEntity]:
+        clauses, params = _bounds('price', min_price, max_price)
+        if not show_deleted:
+            clauses.append('deleted = 0')
+        if after is not None:
+            clauses.append('(price, id) > (?, ?)')
+            params.extend(after)
+        if query is not None:
+            clauses.append('id IN (SELECT rowid FROM items_fts WHERE items_fts MATCH ?)')
+            params.append(_match_prefixes(query))
+        where = ' AND '.join(clauses) or '1'
+
+        rows = self._conn().execute(
+            f'SELECT id, name, price, deleted, version FROM items WHERE {where} ORDER BY price, id LIMIT ? OFFSET ?',
+            (*params, limit, offset))
+        return [_item(row) for row in rows]
+
+    def _update_item_carts(self, conn: sqlite3.Connection, item: tuple) -> None:
+        conn.execute(_UPDATE_ITEM_LINES, (item[1], int(not item[3]), item[0]))
+        conn.execute(_UPDATE_ITEM_CARTS, (item[0],))
+
+    def patch_item(self, id: int, patch_info: PatchItemInfo) -> ItemEntity:
+        with self._transaction(items=True, carts=True) as conn:
+            old = _fetch_one(conn.execute(_SELECT_ITEM, (id,)))
+            if old is None or old[3]:
+                raise ValueError
+            row = _fetch_one(conn.execute(_PATCH_ITEM, (patch_info.name, patch_info.price, id)))
+            self._update_item_carts(conn, row)
+        return _item(row)
+
+    def delete_item(self, id: int) -> ItemEntity:
+        with self._transaction(items=True, carts=True) as conn:
+            old = _fetch_one(conn.execute(_SELECT_ITEM, (id,)))
+            if old is None:
+                raise ValueError
+            row = _fetch_one(conn.execute(_DELETE_ITEM, (id,)))
+            if not old[3]:
+                # a deleted item stays in carts as an unavailable line that no longer counts towards the price
+                self._update_item_carts(conn, row)
+        return _item(row)
@@ -1,44 +1,236 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
+"""Open-loop load generator for the demo user service.
 
-import requests
+Requests are sent at a fixed target rate (or with Poisson arrivals), whatever the
+service's response times, over a pool of keep-alive connections. Latency is taken
+from the moment each request was due, not from when it was actually sent, so a
+service that falls behind shows up in the tail instead of silently slowing the
+generator down (coordinated omission). Requests due during the warmup are sent
+but not recorded.
+
+    python ddoser.py --rate 500 --duration 30 --warmup 5 --mix create-user=1 get-user=3
+
+Latencies go to per-scenario histograms with HdrHistogram's bucketing (about 0.1%
+relative error); `--hgrm PREFIX` also writes each as PREFIX.<scenario>.hgrm in the
+format read by HdrHistogram's plotter.
+"""
+
+import argparse
+import asyncio
+import math
+import random
+import time
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List, Optional, TextIO
+
+import httpx
 from faker import Faker
 
 faker = Faker()
 
+# values below 2 ** SUB_BITS are counted exactly, larger ones with SUB_BITS - 1 bits of precision
+SUB_BITS = 11
+
+
+class Histogram:
+    """Counts of integer values (microseconds here) in log-linear buckets, as HdrHistogram does."""
+
+    def __init__(self) -> None:
+        self.counts = Counter[int]()
+        self.total = 0
+        self.sum = 0
+        self.sum_of_squares = 0
+        self.max = 0
+
+    @staticmethod
+    def _index(value: int) -> int:
+        if value < 1 << SUB_BITS:
+            return value
+        shift = value.bit_length() - SUB_BITS
+        return (shift << (SUB_BITS - 1)) + (value >> shift)
+
+    @staticmethod
+    def _highest_value(index: int) -> int:
+        # the largest value counted in the bucket at `index`
+        if index < 1 << SUB_BITS:
+            return index
+        shift = (index >> (SUB_BITS - 1)) - 1
+        return ((index - (shift << (SUB_BITS - 1)) + 1) << shift) - 1
+
+    def record(self, value: int) -> None:
+        self.counts[self._index(value)] += 1
+        self.total += 1
+        self.sum += value
+        self.sum_of_squares += value * value
+        self.max = max(self.max, value)
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.total if self.total else 0.0
+
+    @property
+    def stddev(self) -> float:
+        return math.sqrt(max(0.0, self.sum_of_squares / self.total - self.mean ** 2)) if self.total else 0.0
+
+    def value_at(self, percentile: float) -> int:
+        if not self.total:
+            return 0
+        rank = max(1, math.ceil(percentile / 100 * self.total))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self._highest_value(index), self.max)
+        return self.max
+
+    def write_hgrm(self, file: TextIO, scale: float = 1000.0, ticks: int = 5) -> None:
+        """Write the percentile distribution with values divided by `scale` (microseconds to ms)."""
+        file.write(f"{'Value':>12} {'Percentile':>14} {'TotalCount':>10} {'1/(1-Percentile)':>14}\n\n")
+        indexes = sorted(self.counts)
+        seen, position, level, written = 0, 0, 0.0, -1
+        while self.total:
+            rank = max(1, math.ceil(level / 100 * self.total))
+            while seen < rank:
+                seen += self.counts[indexes[position]]
+                position += 1
+            value = min(self._highest_value(indexes[position - 1]), self.max)
+            fraction = seen / self.total
+            if fraction >= 1:
+                file.write(f'{value / scale:12.3f} {1.0:14.12f} {seen:10d}\n')
+                break
+            if seen != written:
+                file.write(f'{value / scale:12.3f} {fraction:14.12f} {seen:10d} {1 / (1 - fraction):14.2f}\n')
+                written = seen
+            # as HdrHistogram: `ticks` steps per halving of the distance to 100%
+            level = max(level + 100 / (ticks * 2 ** (int(math.log2(100 / (100 - level))) + 1)), fraction * 100)
+        file.write(f'#[Mean    = {self.mean / scale:12.3f}, StdDeviation   = {self.stddev / scale:12.3f}]\n')
+        file.write(f'#[Max     = {self.max / scale:12.3f}, Total count    = {self.total:12d}]\n')
+
+
+class Scenario:
+    def __init__(self, name: str, send: Callable[[httpx.AsyncClient], Awaitable[httpx.Response]]) -> None:
+        self.name = name
+        self.send = send
+        # from when the request was due, and from when it was sent
+        self.latency = Histogram()
+        self.service_time = Histogram()
+        self.statuses = Counter[str]()
+
+
+# uids of users created so far, so that most reads hit an existing user
+uids = list[int]()
+
+
+async def create_user(client: httpx.AsyncClient) -> httpx.Response:
+    response = await client.post(
+        '/create-user',
+        json={'username': faker.user_name(), 'first_name': faker.first_name(), 'last_name': faker.last_name()},
+    )
+    if response.status_code == 201:
+        uids.append(response.json()['uid'])
+    return response
+
+
+async def get_user(client: httpx.AsyncClient) -> httpx.Response:
+    id = random.choice(uids) if uids else faker.random_number(digits=2)
+    return await client.post('/get-user', params={'id': id})
+
+
+async def get_users(client: httpx.AsyncClient) -> httpx.Response:
+    ids = random.choices(uids, k=50) if uids else [faker.random_number(digits=2) for _ in range(50)]
+    return await client.post('/get-users', json=ids)
+
+
+SCENARIOS = {
+    'create-user': create_user,
+    'get-user': get_user,
+    'get-users': get_users,
+}
+
+
+async def fire(client: httpx.AsyncClient, scenario: Scenario, due: float, recorded: bool) -> None:
+    sent = time.perf_counter()
+    try:
+        status = str((await scenario.send(client)).status_code)
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    done = time.perf_counter()
+    if recorded:
+        scenario.latency.record(round((done - due) * 1e6))
+        scenario.service_time.record(round((done - sent) * 1e6))
+        scenario.statuses[status] += 1
+
+
+async def generate(args: argparse.Namespace, scenarios: List[Scenario], weights: List[float]) -> float:
+    """Send requests on schedule until the run ends; returns how late the latest one was sent."""
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+        start = time.perf_counter()
+        end, measure_from = start + args.warmup + args.duration, start + args.warmup
+        due, lag, tasks = start, 0.0, set()
+        while due < end:
+            # yields even when behind schedule, so the requests in flight keep making progress
+            await asyncio.sleep(max(0.0, due - time.perf_counter()))
+            lag = max(lag, time.perf_counter() - due)
+            scenario = random.choices(scenarios, weights)[0]
+            task = asyncio.create_task(fire(client, scenario, due, due >= measure_from))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            due += random.expovariate(args.rate) if args.poisson else 1 / args.rate
+        await asyncio.gather(*tasks)
+    return lag
 
-def create_users():
-    for _ in range(500):
-        user = faker.profile()
-        response = requests.post(
-            "http://localhost:8080/create-user",
-            json={
-                "username": user["username"],
-                "first_name": user["name"],
-                "last_name": "",
-            },
-        )
 
-        print(response)
+def parse_mix(entries: List[str]) -> Dict[str, float]:
+    mix = {}
+    for entry in entries:
+        name, _, weight = entry.partition('=')
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f'unknown scenario {name!r}, expected one of {", ".join(SCENARIOS)}')
+        mix[name] = float(weight or 1)
+    return mix
 
 
-def get_users():
-    for _ in range(500):
-        
-        response = requests.post(
-            "http://localhost:8080/get-user",
-            params={"id": faker.random_number(digits=2)},
-        )
-        print(response)
+def report(scenarios: List[Scenario], duration: float, lag: float, hgrm: Optional[str]) -> None:
+    ms = 1000
+    print(f"{'scenario':>12} {'count':>8} {'rate/s':>8} {'p50':>8} {'p90':>8} {'p99':>8} {'p99.9':>8} "
+          f"{'max':>8} {'svc p99':>8}  statuses")
+    for scenario in scenarios:
+        latency = scenario.latency
+        statuses = ', '.join(f'{status}: {count}' for status, count in sorted(scenario.statuses.items()))
+        print(f'{scenario.name:>12} {latency.total:>8} {latency.total / duration:>8.1f} '
+              + ' '.join(f'{latency.value_at(p) / ms:>8.2f}' for p in (50, 90, 99, 99.9))
+              + f' {latency.max / ms:>8.2f} {scenario.service_time.value_at(99) / ms:>8.2f}  {statuses}')
+        if hgrm:
+            with open(f'{hgrm}.{scenario.name}.hgrm', 'w') as file:
+                latency.write_hgrm(file)
+    print('latencies in ms from when each request was due; svc: from when it was sent')
+    if lag > 0.01:
+        print(f'warning: the generator fell up to {lag * ms:.0f} ms behind schedule; '
+              'latency still counts from when requests were due, but the client may be the bottleneck')
 
 
-with ThreadPoolExecutor() as executor:
-    futures = {}
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:8080')
+    parser.add_argument('--rate', type=float, default=200, help='target requests per second')
+    parser.add_argument('--duration', type=float, default=30, help='seconds measured')
+    parser.add_argument('--warmup', type=float, default=5, help='seconds sent before measuring')
+    parser.add_argument('--mix', nargs='+', default=['create-user=1', 'get-user=1'],
+                        help='scenario=weight entries, from: ' + ', '.join(SCENARIOS))
+    parser.add_argument('--connections', type=int, default=100, help='size of the keep-alive connection pool')
+    parser.add_argument('--timeout', type=float, default=10, help='seconds before a request fails')
+    parser.add_argument('--poisson', action='store_true', help='exponential gaps between requests instead of even ones')
+    parser.add_argument('--hgrm', metavar='PREFIX', help='write the latency histograms to PREFIX.<scenario>.hgrm')
+    args = parser.parse_args()
+    try:
+        mix = parse_mix(args.mix)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
 
-    for i in range(15):
-        futures[executor.submit(create_users)] = f"create-user-{i}"
+    scenarios = [Scenario(name, SCENARIOS[name]) for name in mix]
+    lag = asyncio.run(generate(args, scenarios, list(mix.values())))
+    report(scenarios, args.duration, lag, args.hgrm)
 
-    for _ in range(15):
-        futures[executor.submit(get_users)] = f"get-users-{i}"
 
-    for future in as_completed(futures):
-        print(f"completed {futures[future]}")
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,7 @@ from fastapi import FastAPI, HTTPException, Query
 from prometheus_fastapi_instrumentator import Instrumentator
 
 from demo_service import store
-from demo_service.contracts import UserRequest, UserResource
+from demo_service.contracts import UserRequest, UserResource, UsersResource
 
 app = FastAPI(title="Demo User API")
 Instrumentator().instrument(app).expose(app)
@@ -17,7 +17,10 @@ Instrumentator().instrument(app).expose(app)
     status_code=HTTPStatus.CREATED,
 )
 async def create_user(body: UserRequest) -> UserResource:
-    return store.insert(body)
+    try:
+        return store.insert(body)
+    except store.UsernameTaken as e:
+        raise HTTPException(HTTPStatus.CONFLICT, f"username taken: {e}")
 
 
 @app.post("/get-user")
@@ -28,3 +31,39 @@ async def get_user(id: Annotated[int, Query()]) -> UserResource:
         raise HTTPException(HTTPStatus.NOT_FOUND)
 
     return resource
+
+
+@app.post(
+    "/create-users",
+    response_model=list[UserResource],
+    status_code=HTTPStatus.CREATED,
+)
+async def create_users(body: list[UserRequest]) -> list[UserResource]:
+    try:
+        return store.insert_many(body)
+    except store.UsernameTaken as e:
+        raise HTTPException(HTTPStatus.CONFLICT, f"username taken: {e}")
+
+
+@app.post("/get-users")
+async def get_users(ids: list[int]) -> UsersResource:
+    # one round trip for many users: found ones are returned, the rest listed as missing
+    users, missing = [], []
+    for id in ids:
+        resource = store.select(id)
+        if resource:
+            users.append(resource)
+        else:
+            missing.append(id)
+
+    return UsersResource(users=users, missing=missing)
+
+
+@app.get("/users/by-username/{username}")
+async def get_user_by_username(username: str) -> UserResource:
+    resource = store.select_by_username(username)
+
+    if not resource:
+        raise HTTPException(HTTPStatus.NOT_FOUND)
+
+    return resource
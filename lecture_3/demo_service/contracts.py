@@ -16,3 +16,9 @@ class UserRequest(BaseModel):
     first_name: str
     last_name: str
     birthdate: datetime | None = None
+
+
+class UsersResource(BaseModel):
+    users: list[UserResource]
+    # requested ids with no user, in request order
+    missing: list[int]
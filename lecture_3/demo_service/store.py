@@ -1,7 +1,15 @@
+import os
 from typing import Iterable
 
 from demo_service.contracts import UserRequest, UserResource
 
+# with DEMO_UNIQUE_USERNAMES=1, a username can only be taken once
+_unique_usernames = os.environ.get("DEMO_UNIQUE_USERNAMES") == "1"
+
+
+class UsernameTaken(ValueError):
+    pass
+
 
 def _generate_int_id() -> Iterable[int]:
     i = 0
@@ -11,17 +19,49 @@ def _generate_int_id() -> Iterable[int]:
 
 
 _users = dict[int, UserResource]()
+# username -> uid of the first user created with it, so lookups and duplicate checks are O(1)
+_uids_by_username = dict[str, int]()
 _id_generator = _generate_int_id()
 
 
-def insert(user: UserRequest) -> UserResource:
+def set_unique_usernames(enabled: bool) -> None:
+    global _unique_usernames
+    _unique_usernames = enabled
+
+
+def _check_usernames(usernames: list[str]) -> None:
+    if not _unique_usernames:
+        return
+    taken = [username for username in usernames if username in _uids_by_username]
+    if taken or len(set(usernames)) < len(usernames):
+        raise UsernameTaken(taken[0] if taken else "duplicate usernames in one request")
+
+
+def _insert(user: UserRequest) -> UserResource:
     id = next(_id_generator)
     resource = UserResource(uid=id, **user.model_dump())
 
     _users[id] = resource
+    _uids_by_username.setdefault(resource.username, id)
 
     return resource
 
 
+def insert(user: UserRequest) -> UserResource:
+    _check_usernames([user.username])
+    return _insert(user)
+
+
+def insert_many(users: list[UserRequest]) -> list[UserResource]:
+    """Insert all users, or none if a username is taken."""
+    _check_usernames([user.username for user in users])
+    return [_insert(user) for user in users]
+
+
 def select(id: int) -> UserResource | None:
     return _users.get(id, None)
+
+
+def select_by_username(username: str) -> UserResource | None:
+    id = _uids_by_username.get(username)
+    return None if id is None else _users[id]
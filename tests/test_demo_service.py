@@ -0,0 +1,104 @@
+import sys
+from http import HTTPStatus
+from pathlib import Path
+
+import pytest
+from faker import Faker
+from fastapi.testclient import TestClient
+
+# the demo service imports itself as a top-level package, as it does when run from lecture_3
+sys.path.insert(0, str(Path(__file__).parents[1] / "lecture_3"))
+
+from demo_service import store  # noqa: E402
+from demo_service.api import app  # noqa: E402
+
+faker = Faker()
+client = TestClient(app)
+
+
+def user(username: str) -> dict:
+    return {"username": username, "first_name": faker.first_name(), "last_name": faker.last_name()}
+
+
+@pytest.fixture(params=[False, True], ids=["duplicates", "unique"])
+def unique_usernames(request) -> bool:
+    store.set_unique_usernames(request.param)
+    yield request.param
+    store.set_unique_usernames(False)
+
+
+@pytest.fixture()
+def username() -> str:
+    return faker.unique.user_name()
+
+
+def test_get_user_by_username(unique_usernames: bool, username: str) -> None:
+    created = client.post("/create-user", json=user(username)).json()
+
+    response = client.get(f"/users/by-username/{username}")
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == created
+
+    assert client.get(f"/users/by-username/{username}-missing").status_code == HTTPStatus.NOT_FOUND
+
+
+def test_create_user_with_taken_username(unique_usernames: bool, username: str) -> None:
+    first = client.post("/create-user", json=user(username)).json()
+
+    response = client.post("/create-user", json=user(username))
+
+    if unique_usernames:
+        assert response.status_code == HTTPStatus.CONFLICT
+    else:
+        assert response.status_code == HTTPStatus.CREATED
+        assert response.json()["uid"] != first["uid"]
+    # the lookup keeps answering with the first user created with the name
+    assert client.get(f"/users/by-username/{username}").json() == first
+
+
+def test_create_users_with_taken_usernames(unique_usernames: bool, username: str) -> None:
+    other, taken = faker.unique.user_name(), faker.unique.user_name()
+    client.post("/create-user", json=user(taken))
+
+    repeated = client.post("/create-users", json=[user(username), user(username)])
+    with_taken = client.post("/create-users", json=[user(other), user(taken)])
+
+    if unique_usernames:
+        assert repeated.status_code == with_taken.status_code == HTTPStatus.CONFLICT
+        # a rejected batch inserts none of its users
+        assert client.get(f"/users/by-username/{username}").status_code == HTTPStatus.NOT_FOUND
+        assert client.get(f"/users/by-username/{other}").status_code == HTTPStatus.NOT_FOUND
+    else:
+        assert repeated.status_code == with_taken.status_code == HTTPStatus.CREATED
+        assert client.get(f"/users/by-username/{username}").json() == repeated.json()[0]
+
+
+def test_create_users() -> None:
+    body = [user(faker.unique.user_name()) for _ in range(3)]
+
+    response = client.post("/create-users", json=body)
+
+    assert response.status_code == HTTPStatus.CREATED
+    created = response.json()
+    assert [resource["username"] for resource in created] == [request["username"] for request in body]
+    assert len({resource["uid"] for resource in created}) == len(body)
+    for resource in created:
+        assert client.post("/get-user", params={"id": resource["uid"]}).json() == resource
+
+
+def test_get_users_returns_found_and_missing_in_request_order() -> None:
+    created = client.post("/create-users", json=[user(faker.unique.user_name()) for _ in range(3)]).json()
+    missing = [-1, -2]
+    ids = [created[2]["uid"], missing[0], created[0]["uid"], missing[1], created[1]["uid"]]
+
+    response = client.post("/get-users", json=ids)
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == {"users": [created[2], created[0], created[1]], "missing": missing}
+
+
+def test_get_users_with_no_ids() -> None:
+    response = client.post("/get-users", json=[])
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == {"users": [], "missing": []}
@@ -1,12 +1,18 @@
+import json
+import threading
+from base64 import urlsafe_b64encode
 from http import HTTPStatus
 from typing import Any
 from uuid import uuid4
 
 import pytest
 from faker import Faker
+from fastapi import FastAPI
 from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
 
 from lecture_2.hw.shop_api.main import app
+from lecture_2.hw.shop_api.routers.admin_routers import router_admin
 
 client = TestClient(app)
 faker = Faker()
@@ -114,6 +120,30 @@ def test_get_cart(request, cart: int, not_empty: bool) -> None:
         assert response_json["price"] == 0.0
 
 
+def test_get_missing_cart() -> None:
+    response = client.get("/cart/-1")
+
+    assert response.status_code == HTTPStatus.NOT_FOUND
+
+
+def test_post_cart_add_many(existing_empty_cart_id: int, existing_items: list[int]) -> None:
+    lines = [{"item_id": existing_items[0], "quantity": 3}, {"item_id": existing_items[1]}]
+
+    response = client.post(f"/cart/{existing_empty_cart_id}/add", json=lines)
+    assert response.status_code == HTTPStatus.CREATED
+    assert [(item["id"], item["quantity"]) for item in response.json()["items"]] == [
+        (existing_items[0], 3),
+        (existing_items[1], 1),
+    ]
+
+    response = client.post(
+        f"/cart/{existing_empty_cart_id}/add",
+        json=[{"item_id": existing_items[0]}, {"item_id": -1}],
+    )
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+    assert client.get(f"/cart/{existing_empty_cart_id}").json()["items"][0]["quantity"] == 3
+
+
 @pytest.mark.parametrize(
     ("query", "status_code"),
     [
@@ -157,6 +187,17 @@ def test_get_cart_list(query: dict[str, Any], status_code: int):
             assert quantity <= query["max_quantity"]
 
 
+def test_get_cart_list_quantity_range(existing_not_empty_cart_id: int) -> None:
+    response = client.get(
+        "/cart", params={"min_quantity": 3, "max_quantity": 3, "limit": 100}
+    )
+    assert response.status_code == HTTPStatus.OK
+
+    data = response.json()
+    assert existing_not_empty_cart_id in [cart["id"] for cart in data]
+    assert all(sum(item["quantity"] for item in cart["items"]) == 3 for cart in data)
+
+
 def test_post_item() -> None:
     item = {"name": "test item", "price": 9.99}
     response = client.post("/item", json=item)
@@ -168,6 +209,58 @@ def test_post_item() -> None:
     assert item["name"] == data["name"]
 
 
+def test_post_item_batch() -> None:
+    items = [{"name": f"batch item {i}", "price": 1.0 + i} for i in range(50)]
+
+    response = client.post("/item/batch", json=items)
+    assert response.status_code == HTTPStatus.CREATED
+    created = response.json()
+    assert [{"name": item["name"], "price": item["price"]} for item in created] == items
+    assert client.get(f"/item/{created[-1]['id']}").json() == created[-1]
+
+    response = client.post(
+        "/item/batch",
+        content="\n".join(json.dumps(item) for item in items[:3]) + "\n",
+        headers={"content-type": "application/x-ndjson"},
+    )
+    assert response.status_code == HTTPStatus.CREATED
+    assert [item["name"] for item in response.json()] == [item["name"] for item in items[:3]]
+
+
+@pytest.mark.parametrize(
+    ("content", "content_type"),
+    [
+        ('[{"name": "ok", "price": 1.0}, {"price": 1.0}]', "application/json"),
+        ('{"name": "ok", "price": 1.0}\nnot json\n', "application/x-ndjson"),
+    ],
+)
+def test_post_item_batch_invalid(content: str, content_type: str) -> None:
+    response = client.post("/item/batch", content=content, headers={"content-type": content_type})
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+
+def test_export_items(deleted_item: dict[str, Any]) -> None:
+    response = client.get("/item/export")
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers["content-type"] == "application/x-ndjson"
+
+    exported = [json.loads(line) for line in response.text.splitlines()]
+    assert len(exported) == len({item["id"] for item in exported})
+    assert deleted_item in exported
+    assert len(exported) == len(client.get("/item", params={"show_deleted": True, "limit": 10**6}).json())
+
+    response = client.get("/item/export", params={"show_deleted": False})
+    assert deleted_item["id"] not in [json.loads(line)["id"] for line in response.text.splitlines()]
+
+
+def test_export_carts(existing_not_empty_cart_id: int) -> None:
+    response = client.get("/cart/export")
+    assert response.status_code == HTTPStatus.OK
+
+    exported = {cart["id"]: cart for cart in map(json.loads, response.text.splitlines())}
+    assert exported[existing_not_empty_cart_id] == client.get(f"/cart/{existing_not_empty_cart_id}").json()
+
+
 def test_get_item(existing_item: dict[str, Any]) -> None:
     item_id = existing_item["id"]
 
@@ -177,6 +270,49 @@ def test_get_item(existing_item: dict[str, Any]) -> None:
     assert response.json() == existing_item
 
 
+def test_get_item_etag(existing_item: dict[str, Any]) -> None:
+    item_id = existing_item["id"]
+    etag = client.get(f"/item/{item_id}").headers["etag"]
+
+    response = client.get(f"/item/{item_id}", headers={"if-none-match": etag})
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+    assert response.headers["etag"] == etag
+
+    client.patch(f"/item/{item_id}", json={"price": 1.0})
+    response = client.get(f"/item/{item_id}", headers={"if-none-match": f'"other", W/{etag}'})
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers["etag"] != etag
+
+    client.delete(f"/item/{item_id}")
+    response = client.get(f"/item/{item_id}", headers={"if-none-match": response.headers["etag"]})
+    assert response.status_code == HTTPStatus.NOT_FOUND
+    # `*` only matches an item that exists
+    assert client.get(f"/item/{item_id}", headers={"if-none-match": "*"}).status_code == HTTPStatus.NOT_FOUND
+
+
+def test_get_item_encoded_after_patch(existing_item: dict[str, Any]) -> None:
+    item_id = existing_item["id"]
+    client.get(f"/item/{item_id}")
+
+    patched = client.patch(f"/item/{item_id}", json={"name": "Переименованный товар"})
+    response = client.get(f"/item/{item_id}")
+
+    # the cached encoding is replaced and matches the model's own serialisation byte for byte
+    assert response.content == patched.content
+    assert response.json()["name"] == "Переименованный товар"
+
+
+def test_get_cart_etag(existing_empty_cart_id: int, existing_items: list[int]) -> None:
+    etag = client.get(f"/cart/{existing_empty_cart_id}").headers["etag"]
+    response = client.get(f"/cart/{existing_empty_cart_id}", headers={"if-none-match": etag})
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+
+    client.post(f"/cart/{existing_empty_cart_id}/add/{existing_items[0]}")
+    response = client.get(f"/cart/{existing_empty_cart_id}", headers={"if-none-match": etag})
+    assert response.status_code == HTTPStatus.OK
+    assert len(response.json()["items"]) == 1
+
+
 @pytest.mark.parametrize(
     ("query", "status_code"),
     [
@@ -211,6 +347,104 @@ def test_get_item_list(query: dict[str, Any], status_code: int) -> None:
             assert all(item["deleted"] is False for item in data)
 
 
+def test_get_item_list_price_range() -> None:
+    cheap = client.post("/item", json={"name": "cheap", "price": 0.5}).json()
+    client.patch(f"/item/{cheap['id']}", json={"price": 0.25})
+
+    response = client.get("/item", params={"max_price": 0.3, "limit": 100})
+    assert response.status_code == HTTPStatus.OK
+    assert cheap["id"] in [item["id"] for item in response.json()]
+
+    response = client.get("/item", params={"min_price": 10.0, "limit": 100})
+    prices = [item["price"] for item in response.json()]
+    assert prices == sorted(prices)
+    assert all(price >= 10.0 for price in prices)
+
+
+def test_get_item_list_cached(existing_item: dict[str, Any]) -> None:
+    query = {"min_price": 10_000.0, "max_price": 10_001.0}
+    hits = REGISTRY.get_sample_value("shop_response_cache_hits_total", {"cache": "items"}) or 0.0
+
+    assert client.get("/item/", params=query).json() == []
+    assert client.get("/item/", params=query).json() == []
+    assert REGISTRY.get_sample_value("shop_response_cache_hits_total", {"cache": "items"}) == hits + 1
+
+    # cart writes leave cached item listings alone
+    cart_id = client.post("/cart").json()["id"]
+    client.post(f"/cart/{cart_id}/add/{existing_item['id']}")
+    assert client.get("/item/", params=query).json() == []
+    assert REGISTRY.get_sample_value("shop_response_cache_hits_total", {"cache": "items"}) == hits + 2
+
+    # any item write invalidates the cached listing
+    item = client.post("/item", json={"name": "Дорогой товар", "price": 10_000.5}).json()
+    assert client.get("/item/", params=query).json() == [item]
+
+
+def test_get_item_list_search() -> None:
+    word = uuid4().hex
+    created = client.post(
+        "/item/batch",
+        json=[{"name": f"{word} {color}", "price": price} for color, price in [("red", 30.0), ("blue", 20.0)]],
+    ).json()
+
+    response = client.get("/item/", params={"q": word[:8]})
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == created[::-1]
+
+    assert client.get("/item/", params={"q": f"{word} re"}).json() == created[:1]
+    assert client.get("/item/", params={"q": word, "max_price": 25.0}).json() == created[1:]
+    assert client.get("/item/", params={"q": "?!"}).status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+
+def test_get_item_list_cursor() -> None:
+    ids = [
+        client.post("/item", json={"name": f"paged {i}", "price": 0.01 * (i % 3 + 1)}).json()["id"]
+        for i in range(7)
+    ]
+    query = {"max_price": 0.05, "limit": 3}
+    expected = client.get("/item", params={**query, "limit": 100}).json()
+
+    pages, response = [], client.get("/item", params=query)
+    while "link" in response.headers:
+        pages.extend(response.json())
+        next_url = response.headers["link"].split(";")[0].strip("<>")
+        response = client.get(next_url)
+    pages.extend(response.json())
+
+    assert pages == expected
+    assert set(ids) <= {item["id"] for item in pages}
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "not a cursor",
+        "WyJxdWFudGl0eSIsMSwxXQ==",
+        *(urlsafe_b64encode(f'["price",{value},1]'.encode()).decode() for value in ["NaN", "Infinity", "-Infinity", "1e400"]),
+    ],
+)
+def test_get_list_bad_cursor(cursor: str) -> None:
+    assert client.get("/item", params={"cursor": cursor}).status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+    assert client.get("/cart", params={"cursor": cursor}).status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+
+@pytest.mark.parametrize("price", ["NaN", "Infinity", "-Infinity"])
+def test_non_finite_price_rejected(existing_item: dict[str, Any], price: str) -> None:
+    # the JSON literals Python's json module writes for non-finite floats
+    item_id = existing_item["id"]
+    headers = {"content-type": "application/json"}
+    for method, url, content in [
+        ("POST", "/item", f'{{"name": "item", "price": {price}}}'),
+        ("POST", "/item/batch", f'[{{"name": "item", "price": {price}}}]'),
+        ("PUT", f"/item/{item_id}", f'{{"name": "item", "price": {price}}}'),
+        ("PATCH", f"/item/{item_id}", f'{{"price": {price}}}'),
+    ]:
+        response = client.request(method, url, content=content, headers=headers)
+        assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+    assert client.get(f"/item/{item_id}").json() == existing_item
+
+
 @pytest.mark.parametrize(
     ("body", "status_code"),
     [
@@ -283,3 +517,44 @@ def test_delete_item(existing_item: dict[str, Any]) -> None:
 
     response = client.delete(f"/item/{item_id}")
     assert response.status_code == HTTPStatus.OK
+
+
+def test_storage_call_histogram() -> None:
+    count = REGISTRY.get_sample_value("shop_storage_call_seconds_count", {"function": "get_carts"}) or 0.0
+
+    client.get("/cart/", params={"min_price": 123_456.0})
+
+    assert REGISTRY.get_sample_value("shop_storage_call_seconds_count", {"function": "get_carts"}) >= count + 1
+
+
+def test_admin_profile() -> None:
+    admin = FastAPI()
+    admin.include_router(router_admin)
+    stop = threading.Event()
+
+    def busy_worker() -> None:
+        while not stop.is_set():
+            sum(range(1000))
+
+    worker = threading.Thread(target=busy_worker, name="busy")
+    worker.start()
+    try:
+        response = TestClient(admin).get("/admin/profile", params={"seconds": 0.2, "interval": 0.001})
+    finally:
+        stop.set()
+        worker.join()
+
+    assert response.status_code == HTTPStatus.OK
+    stacks = [line.rsplit(" ", 1) for line in response.text.splitlines()]
+    assert any(stack.startswith("busy;") and "busy_worker" in stack for stack, _ in stacks)
+    assert all(int(count) > 0 for _, count in stacks)
+    assert TestClient(admin).get("/admin/profile", params={"seconds": 0}).status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+
+def test_storage_stats_exported() -> None:
+    items = REGISTRY.get_sample_value("shop_storage_entities", {"kind": "items"})
+
+    client.post("/item", json={"name": "counted", "price": 1.0})
+
+    assert REGISTRY.get_sample_value("shop_storage_entities", {"kind": "items"}) == items + 1
+    assert REGISTRY.get_sample_value("shop_storage_cart_lines_average") >= 0.0
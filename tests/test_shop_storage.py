@@ -0,0 +1,588 @@
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from prometheus_client import REGISTRY
+
+from lecture_2.hw.shop_api import storage as shop_storage
+from lecture_2.hw.shop_api.storage import (
+    ItemEntity, ItemInfo, MemoryStorage, PatchItemInfo, SQLiteStorage, Storage, aio, get_storage, memory, set_storage,
+)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def storage(request, tmp_path) -> Storage:
+    if request.param == "memory":
+        return MemoryStorage()
+    return SQLiteStorage(str(tmp_path / "shop.db"))
+
+
+def test_items(storage: Storage) -> None:
+    items = [storage.create_item(ItemInfo(name=f"item {i}", price=p)) for i, p in enumerate([30.0, 10.0, 20.0])]
+
+    assert [item.price for item in storage.get_items(0, 10, None, None, False)] == [10.0, 20.0, 30.0]
+    assert [item.price for item in storage.get_items(1, 1, None, None, False)] == [20.0]
+    assert [item.price for item in storage.get_items(0, 10, 15.0, 25.0, False)] == [20.0]
+    assert [item.price for item in storage.get_items(0, 1, None, None, False, after=(20.0, items[2].id))] == [30.0]
+
+    patched = storage.patch_item(items[0].id, PatchItemInfo(price=5.0))
+    assert patched.price == 5.0 and patched.name == "item 0"
+    assert storage.get_item(items[0].id) == patched
+
+    assert storage.delete_item(items[1].id).deleted
+    assert storage.get_item_version(items[1].id) is None
+    assert storage.get_item_version(items[0].id) == patched.version
+    assert [item.price for item in storage.get_items(0, 10, None, None, False)] == [5.0, 20.0]
+    assert [item.price for item in storage.get_items(0, 10, None, None, True)] == [5.0, 10.0, 20.0]
+
+    with pytest.raises(ValueError):
+        storage.patch_item(items[1].id, PatchItemInfo(name="deleted"))
+    with pytest.raises(ValueError):
+        storage.delete_item(-1)
+
+
+@pytest.mark.parametrize("price", [float("nan"), float("inf"), float("-inf")])
+def test_non_finite_prices_are_rejected(storage: Storage, price: float) -> None:
+    items = storage.create_items([ItemInfo(name=f"item {i}", price=p) for i, p in enumerate([1.0, 2.0, 3.0, 4.0])])
+    previous = get_storage()
+    try:
+        set_storage(storage)
+        with pytest.raises(ValueError):
+            shop_storage.create_item(ItemInfo(name="bad", price=price))
+        with pytest.raises(ValueError):
+            shop_storage.create_items([ItemInfo(name="good", price=2.5), ItemInfo(name="bad", price=price)])
+        with pytest.raises(ValueError):
+            shop_storage.patch_item(items[0].id, PatchItemInfo(price=price))
+        with pytest.raises(ValueError):
+            shop_storage.update_item(items[0].id, ItemInfo(name="bad", price=price))
+    finally:
+        set_storage(previous)
+
+    # nothing was written, so the price index still lists every item exactly once
+    assert storage.get_items(0, 10, None, None, False) == [storage.get_item(item.id) for item in items]
+
+
+def test_create_items(storage: Storage) -> None:
+    single = storage.create_item(ItemInfo(name="single", price=45.5))
+    batch = storage.create_items([ItemInfo(name=f"batch {i}", price=40.0 + i) for i in range(40)])
+
+    assert [storage.get_item(item.id) for item in batch] == batch
+    assert storage.get_items(0, 10, 45.0, 46.0, False) == [batch[5], single, batch[6]]
+    assert len({item.id for item in batch} | {single.id}) == 41
+
+
+def test_search_items(storage: Storage) -> None:
+    names = ["Red apple", "Green apple", "Apricot jam", "Красное яблоко", "pineapple_juice"]
+    items = storage.create_items([ItemInfo(name=name, price=float(i)) for i, name in enumerate(names)])
+
+    def search(query: list[str], **kwargs) -> list[str]:
+        params = {"min_price": None, "max_price": None, "show_deleted": False} | kwargs
+        return [item.name for item in storage.get_items(0, 10, **params, query=query)]
+
+    assert search(["ap"]) == ["Red apple", "Green apple", "Apricot jam"]
+    assert search(["apple", "gr"]) == ["Green apple"]
+    assert search(["ябл"]) == ["Красное яблоко"]
+    assert search(["juice"]) == ["pineapple_juice"]
+    assert search(["apple"]) == ["Red apple", "Green apple"]
+    assert search(["ap"], min_price=1.0) == ["Green apple", "Apricot jam"]
+    assert search(["ap"], after=(0.0, items[0].id)) == ["Green apple", "Apricot jam"]
+    assert search(["pear"]) == []
+
+    storage.patch_item(items[0].id, PatchItemInfo(name="Red pear"))
+    storage.delete_item(items[1].id)
+    assert search(["apple"]) == []
+    assert search(["apple"], show_deleted=True) == ["Green apple"]
+    assert search(["pe"]) == ["Red pear"]
+
+
+def test_carts(storage: Storage) -> None:
+    cheap = storage.create_item(ItemInfo(name="cheap", price=1.0))
+    expensive = storage.create_item(ItemInfo(name="expensive", price=100.0))
+    empty = storage.create_cart()
+    cart = storage.create_cart()
+
+    storage.add_item_to_cart(cart.id, cheap.id)
+    storage.add_item_to_cart(cart.id, expensive.id)
+    cart = storage.add_item_to_cart(cart.id, cheap.id)
+
+    assert [(line.id, line.quantity) for line in cart.items] == [(cheap.id, 2), (expensive.id, 1)]
+    assert cart.price == pytest.approx(102.0)
+    assert storage.get_cart(cart.id) == cart
+    assert storage.get_cart(empty.id).items == []
+
+    assert [c.id for c in storage.get_carts(0, 10, None, None, None, None)] == [empty.id, cart.id]
+    assert [c.id for c in storage.get_carts(0, 10, 50.0, None, None, None)] == [cart.id]
+    assert [c.id for c in storage.get_carts(0, 10, None, None, 3, 3)] == [cart.id]
+    assert [c.id for c in storage.get_carts(0, 10, None, 0.0, None, 0)] == [empty.id]
+
+    assert storage.get_carts(0, 10, None, None, None, None, after=(0.0, empty.id)) == [cart]
+    assert storage.get_carts(0, 10, None, None, 0, None, after=(0, empty.id)) == [cart]
+    assert storage.get_carts(0, 10, 0.0, None, 1, None, after=(0.0, empty.id)) == [cart]
+
+    cart = storage.add_items_to_cart(empty.id, [(expensive.id, 2), (cheap.id, 1), (expensive.id, 1)])
+    assert [(line.id, line.quantity) for line in cart.items] == [(expensive.id, 3), (cheap.id, 1)]
+    assert cart.price == pytest.approx(301.0)
+
+    with pytest.raises(ValueError):
+        storage.add_items_to_cart(empty.id, [(cheap.id, 1), (-1, 1)])
+    assert storage.get_cart(empty.id) == cart
+    with pytest.raises(ValueError):
+        storage.add_item_to_cart(cart.id, -1)
+    with pytest.raises(ValueError):
+        storage.add_item_to_cart(-1, cheap.id)
+
+
+def test_sqlite_reindexes_names_only_when_they_change(tmp_path) -> None:
+    path = str(tmp_path / "shop.db")
+    # a database whose trigger reindexed the name on every update of the column
+    SQLiteStorage(path)._conn().executescript("""
+        DROP TRIGGER items_fts_update;
+        CREATE TRIGGER items_fts_update AFTER UPDATE OF name ON items BEGIN
+            INSERT INTO items_fts (items_fts, rowid, name) VALUES ('delete', old.id, old.name);
+            INSERT INTO items_fts (rowid, name) VALUES (new.id, new.name);
+        END;
+    """)
+    storage = SQLiteStorage(path)
+    item = storage.create_item(ItemInfo(name="Red apple", price=1.0))
+    statements = []
+    storage._conn().set_trace_callback(statements.append)
+
+    storage.patch_item(item.id, PatchItemInfo(price=2.0))
+    assert not [statement for statement in statements if "items_fts" in statement]
+    storage.patch_item(item.id, PatchItemInfo(name="Green pear"))
+    assert [statement for statement in statements if "items_fts" in statement]
+    storage._conn().set_trace_callback(None)
+    assert [found.name for found in storage.get_items(0, 10, None, None, False, query=["pear"])] == ["Green pear"]
+    assert storage.get_items(0, 10, None, None, False, query=["apple"]) == []
+
+
+def test_sqlite_workers_lease_distinct_ids(tmp_path) -> None:
+    path = str(tmp_path / "shop.db")
+    workers = [SQLiteStorage(path, id_block_size=3) for _ in range(2)]
+
+    item_ids = [
+        workers[i % 2].create_item(ItemInfo(name=f"item {i}", price=1.0)).id
+        for i in range(10)
+    ]
+    cart_ids = [workers[i % 2].create_cart().id for i in range(4)]
+
+    # each worker takes its next block of 3 once the previous one is used up
+    assert sorted(item_ids) == [0, 1, 2, 3, 4, 5, 6, 7, 9, 10]
+    assert sorted(cart_ids) == [0, 1, 3, 4]
+
+    restarted = SQLiteStorage(path, id_block_size=3)
+    assert restarted.create_item(ItemInfo(name="after restart", price=1.0)).id not in item_ids
+
+
+def test_sqlite_reads_carts_consistently(tmp_path) -> None:
+    # two stores on one file stand for two workers: one adds lines while the other reads
+    path = str(tmp_path / "shop.db")
+    writer, reader = SQLiteStorage(path), SQLiteStorage(path)
+    items = writer.create_items([ItemInfo(name=f"item {i}", price=1.0) for i in range(20)])
+    cart = writer.create_cart()
+    done = threading.Event()
+
+    def add_lines() -> None:
+        for item in items * 5:
+            writer.add_item_to_cart(cart.id, item.id)
+        done.set()
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    adder = threading.Thread(target=add_lines)
+    adder.start()
+    try:
+        while not done.is_set():
+            for read in [reader.get_cart(cart.id), *reader.get_carts(0, 10, None, None, None, None)]:
+                assert read.price == read.quantity == sum(line.quantity for line in read.items)
+    finally:
+        adder.join()
+        sys.setswitchinterval(interval)
+
+
+def test_item_changes_update_carts(storage: Storage) -> None:
+    item = storage.create_item(ItemInfo(name="item", price=10.0))
+    other = storage.create_item(ItemInfo(name="other", price=1.0))
+    carts = [storage.create_cart() for _ in range(3)]
+    storage.add_items_to_cart(carts[0].id, [(item.id, 2), (other.id, 1)])
+    storage.add_items_to_cart(carts[1].id, [(item.id, 1)])
+    storage.add_items_to_cart(carts[2].id, [(other.id, 1)])
+    versions = [storage.get_cart_version(cart.id) for cart in carts]
+
+    storage.patch_item(item.id, PatchItemInfo(name="renamed", price=20.0))
+    assert [storage.get_cart(cart.id).price for cart in carts] == pytest.approx([41.0, 20.0, 1.0])
+    assert storage.get_cart(carts[0].id).items[0].name == "renamed"
+    assert [c.id for c in storage.get_carts(0, 10, 15.0, None, None, None)] == [carts[1].id, carts[0].id]
+    assert storage.get_cart_version(carts[2].id) == versions[2]
+    assert storage.get_cart_version(carts[0].id) != versions[0]
+
+    storage.delete_item(item.id)
+    storage.delete_item(item.id)
+    cart = storage.get_cart(carts[0].id)
+    assert cart.price == pytest.approx(1.0)
+    assert [line.available for line in cart.items] == [False, True]
+    assert storage.get_carts(0, 10, None, 0.0, None, None) == [storage.get_cart(carts[1].id)]
+
+    with pytest.raises(ValueError):
+        storage.add_item_to_cart(carts[2].id, item.id)
+
+
+def test_cart_prices_do_not_drift(storage: Storage) -> None:
+    items = storage.create_items([ItemInfo(name=f"item {i}", price=p) for i, p in enumerate([0.1, 0.2, 0.3])])
+    cart = storage.create_cart()
+    for item in items:
+        storage.add_item_to_cart(cart.id, item.id)
+    for price in [0.7, 1.1, 0.3]:
+        storage.patch_item(items[0].id, PatchItemInfo(price=price))
+
+    for item in items:
+        storage.delete_item(item.id)
+    assert storage.get_cart(cart.id).price == 0.0
+    assert [c.id for c in storage.get_carts(0, 10, None, 0.0, None, None)] == [cart.id]
+
+
+def test_cart_listings_follow_many_total_changes(storage: Storage) -> None:
+    rng = random.Random(0)
+    items = storage.create_items([ItemInfo(name=f"item {i}", price=float(i % 7) + 0.5) for i in range(20)])
+    carts = [storage.create_cart() for _ in range(50)]
+    # more changes than the memory store queues before applying them to its cart indexes
+    for i in range(1500):
+        storage.add_items_to_cart(rng.choice(carts).id, [(rng.choice(items).id, rng.randint(1, 3))])
+        if i % 500 == 0:
+            storage.get_carts(0, 1, None, None, None, None)
+    storage.patch_item(items[0].id, PatchItemInfo(price=100.0))
+    storage.delete_item(items[1].id)
+
+    current = [storage.get_cart(cart.id) for cart in carts]
+    by_price = sorted(current, key=lambda cart: (cart.price, cart.id))
+    assert storage.get_carts(0, 100, None, None, None, None) == by_price
+    by_quantity = sorted(current, key=lambda cart: (cart.quantity, cart.id))
+    assert storage.get_carts(0, 100, None, None, 0, None) == by_quantity
+    assert storage.get_carts(0, 100, 300.0, None, 50, 70) == [
+        cart for cart in by_price if cart.price >= 300.0 and 50 <= cart.quantity <= 70
+    ]
+
+
+def test_concurrent_adds_are_not_lost(storage: Storage) -> None:
+    items = storage.create_items([ItemInfo(name=f"item {i}", price=0.5) for i in range(4)])
+    cart = storage.create_cart()
+
+    def add(item_id: int) -> None:
+        for _ in range(200):
+            storage.add_item_to_cart(cart.id, item_id)
+        storage.patch_item(item_id, PatchItemInfo(price=1.0))
+
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(add, [item.id for item in items]))
+
+    cart = storage.get_cart(cart.id)
+    assert [line.quantity for line in cart.items] == [200] * 4
+    assert cart.price == pytest.approx(800.0)
+
+
+def test_writes_change_generation(storage: Storage) -> None:
+    generations = [(storage.get_item_generation(), storage.get_cart_generation())]
+
+    def changed() -> tuple[bool, bool]:
+        generations.append((storage.get_item_generation(), storage.get_cart_generation()))
+        (items, carts), (previous_items, previous_carts) = generations[-1], generations[-2]
+        return items != previous_items, carts != previous_carts
+
+    item = storage.create_item(ItemInfo(name="item", price=1.0))
+    assert changed() == (True, False)
+    storage.create_items([ItemInfo(name="other", price=2.0)])
+    assert changed() == (True, False)
+    cart = storage.create_cart()
+    assert changed() == (False, True)
+    storage.add_item_to_cart(cart.id, item.id)
+    assert changed() == (False, True)
+    # item changes reprice the carts holding them
+    storage.patch_item(item.id, PatchItemInfo(price=3.0))
+    assert changed() == (True, True)
+    storage.delete_item(item.id)
+    assert changed() == (True, True)
+
+    storage.get_items(0, 10, None, None, True)
+    storage.get_carts(0, 10, None, None, None, None)
+    assert changed() == (False, False)
+
+
+def test_stats(storage: Storage) -> None:
+    items = storage.create_items([ItemInfo(name=f"item {i}", price=float(i)) for i in range(4)])
+    carts = [storage.create_cart() for _ in range(2)]
+    storage.add_items_to_cart(carts[0].id, [(items[0].id, 2), (items[1].id, 1)])
+    storage.add_item_to_cart(carts[1].id, items[0].id)
+    storage.delete_item(items[3].id)
+
+    stats = storage.get_stats()
+    assert (stats.items, stats.deleted_items, stats.tombstones) == (3, 1, 1)
+    assert (stats.carts, stats.cart_lines) == (2, 3)
+
+
+def test_memory_storage_observes_scans() -> None:
+    def sample(name: str) -> float:
+        return REGISTRY.get_sample_value(name, {"function": "get_items"}) or 0.0
+
+    storage = MemoryStorage()
+    items = storage.create_items([ItemInfo(name=f"item {i}", price=float(i)) for i in range(10)])
+    for item in items[:8]:
+        storage.delete_item(item.id)
+    scanned, selectivity = sample("shop_storage_scanned_entities_sum"), sample("shop_storage_filter_selectivity_sum")
+
+    assert len(storage.get_items(0, 10, None, None, False)) == 2
+    assert sample("shop_storage_scanned_entities_sum") == scanned + 10
+    assert sample("shop_storage_filter_selectivity_sum") == pytest.approx(selectivity + 0.2)
+
+    storage.compact()
+    assert len(storage.get_items(0, 10, None, None, False)) == 2
+    assert sample("shop_storage_scanned_entities_sum") == scanned + 12
+
+
+def test_memory_storage_compacts_deleted_items() -> None:
+    storage = MemoryStorage()
+    items = storage.create_items([ItemInfo(name=f"item {i}", price=float(i)) for i in range(6)])
+    cart = storage.create_cart()
+    storage.add_items_to_cart(cart.id, [(items[1].id, 1), (items[2].id, 1)])
+    for item in items[1::2]:
+        storage.delete_item(item.id)
+    listed = storage.get_items(0, 10, None, None, True)
+    deleted = storage.get_item(items[1].id)
+
+    assert storage.compact(batch_size=2) == 3
+    assert storage.compact() == 0
+    assert storage.get_items(0, 10, None, None, True) == listed
+    assert storage.get_items(1, 2, 0.5, None, True, after=(1.0, items[1].id)) == listed[3:5]
+    assert [item.id for item in storage.get_items(0, 10, None, None, False)] == [item.id for item in items[::2]]
+    assert storage.get_items(0, 10, None, None, True, query=["item"]) == listed
+    assert storage.get_item(items[1].id) == deleted
+    assert storage.get_item_version(items[1].id) is None
+    assert storage.get_cart(cart.id).price == pytest.approx(2.0)
+
+    assert storage.delete_item(items[1].id).version == deleted.version + 1
+    with pytest.raises(ValueError):
+        storage.patch_item(items[1].id, PatchItemInfo(name="compacted"))
+    with pytest.raises(ValueError):
+        storage.add_item_to_cart(cart.id, items[1].id)
+
+
+def test_memory_storage_expires_and_evicts_carts(monkeypatch, tmp_path) -> None:
+    clock = [0.0]
+    monkeypatch.setattr(memory.time, "monotonic", lambda: clock[0])
+    evicted = {
+        reason: REGISTRY.get_sample_value("shop_carts_evicted_total", {"reason": reason}) or 0.0
+        for reason in ["ttl", "cap"]
+    }
+
+    path = str(tmp_path / "data")
+    storage = MemoryStorage.recover(path, cart_ttl=10.0, max_carts=3)
+    item = storage.create_item(ItemInfo(name="item", price=1.0))
+    touched, idle = storage.create_cart(), storage.create_cart()
+    storage.add_item_to_cart(idle.id, item.id)
+    clock[0] = 5.0
+    storage.get_cart(touched.id)
+    clock[0] = 12.0
+    carts = [storage.create_cart()]
+    assert storage.get_cart(idle.id) is None
+    assert storage.get_cart(touched.id) is not None
+
+    clock[0] = 13.0
+    carts += [storage.create_cart(), storage.create_cart()]
+    # the cap evicts the least recently touched cart
+    assert storage.get_cart(touched.id) is None
+    assert [cart.id for cart in storage.get_carts(0, 10, None, None, None, None)] == [cart.id for cart in carts]
+    assert storage.patch_item(item.id, PatchItemInfo(price=2.0)).price == 2.0
+    assert REGISTRY.get_sample_value("shop_carts_evicted_total", {"reason": "ttl"}) == evicted["ttl"] + 1
+    assert REGISTRY.get_sample_value("shop_carts_evicted_total", {"reason": "cap"}) == evicted["cap"] + 1
+    storage.close()
+
+    recovered = MemoryStorage.recover(path)
+    assert [cart.id for cart in recovered.get_carts(0, 10, None, None, None, None)] == [cart.id for cart in carts]
+    assert recovered.create_cart().id > carts[-1].id
+    recovered.close()
+
+
+def test_memory_storage_expires_a_backlog_in_bounded_steps(monkeypatch, tmp_path) -> None:
+    clock = [0.0]
+    monkeypatch.setattr(memory.time, "monotonic", lambda: clock[0])
+    path = str(tmp_path / "data")
+    storage = MemoryStorage.recover(path, cart_ttl=10.0)
+    idle = [storage.create_cart() for _ in range(50)]
+    waits = []
+    monkeypatch.setattr(storage._journal, "wait", lambda ticket, wait=storage._journal.wait: waits.append(wait(ticket)))
+
+    clock[0] = 20.0
+    created = storage.create_cart()
+    # the create expires only a few of the due carts
+    assert storage.get_stats().carts == 1 + len(idle) - memory._EXPIRE_PER_CREATE
+    waits.clear()
+    assert storage.expire_carts() == len(idle) - memory._EXPIRE_PER_CREATE
+    # all expire records share one wait for the disk
+    assert len(waits) == 1
+    storage.close()
+
+    recovered = MemoryStorage.recover(path)
+    assert [cart.id for cart in recovered.get_carts(0, 100, None, None, None, None)] == [created.id]
+    recovered.close()
+
+
+def test_memory_storage_counts_cart_lines(monkeypatch, tmp_path) -> None:
+    clock = [0.0]
+    monkeypatch.setattr(memory.time, "monotonic", lambda: clock[0])
+    path = str(tmp_path / "data")
+    storage = MemoryStorage.recover(path, cart_ttl=10.0)
+    items = storage.create_items([ItemInfo(name=f"item {i}", price=1.0) for i in range(3)])
+    idle, kept = storage.create_cart(), storage.create_cart()
+    storage.add_items_to_cart(idle.id, [(item.id, 1) for item in items])
+    storage.add_items_to_cart(kept.id, [(items[0].id, 1), (items[0].id, 2)])
+    storage.snapshot()
+    clock[0] = 5.0
+    storage.add_item_to_cart(kept.id, items[1].id)
+    assert storage.get_stats().cart_lines == 5
+
+    clock[0] = 12.0
+    storage.expire_carts()
+    assert storage.get_stats().cart_lines == 2
+    storage.close()
+
+    # the snapshot holds both carts, the log adds a line and then expires one of them
+    recovered = MemoryStorage.recover(path)
+    assert recovered.get_stats().cart_lines == 2
+    recovered.close()
+
+
+def test_memory_storage_version_lookups_touch_carts(monkeypatch) -> None:
+    clock = [0.0]
+    monkeypatch.setattr(memory.time, "monotonic", lambda: clock[0])
+    storage = MemoryStorage(cart_ttl=10.0)
+    polled = storage.create_cart()
+
+    # a client polling with If-None-Match only ever gets the version
+    for clock[0] in [5.0, 10.0, 15.0, 20.0]:
+        assert storage.get_cart_version(polled.id) == polled.version
+        storage.expire_carts()
+    clock[0] = 31.0
+    storage.expire_carts()
+    assert storage.get_cart_version(polled.id) is None
+
+
+def test_memory_storage_lists_carts_while_expiring(monkeypatch) -> None:
+    clock = [0.0]
+    monkeypatch.setattr(memory.time, "monotonic", lambda: clock[0])
+    storage = MemoryStorage(cart_ttl=10.0)
+    for _ in range(3000):
+        storage.create_cart()
+    clock[0] = 20.0
+    errors, done = [], threading.Event()
+
+    def list_carts() -> None:
+        while not done.is_set():
+            try:
+                storage.get_carts(0, 100, None, None, None, None)
+                storage.get_carts(0, 100, 0.0, None, 0, 10)
+            except Exception as e:
+                errors.append(e)
+
+    # switching threads often makes the lister run between the steps of each removal
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    lister = threading.Thread(target=list_carts)
+    lister.start()
+    try:
+        assert storage.expire_carts() == 3000
+    finally:
+        done.set()
+        lister.join()
+        sys.setswitchinterval(interval)
+    assert errors == []
+    assert storage.get_carts(0, 10, None, None, None, None) == []
+
+
+def test_memory_storage_recovers_from_journal(tmp_path) -> None:
+    path = str(tmp_path / "data")
+    storage = MemoryStorage.recover(path)
+    items = storage.create_items([ItemInfo(name=f"item {i}", price=1.0 + i) for i in range(3)])
+    cart = storage.create_cart()
+    storage.add_items_to_cart(cart.id, [(items[0].id, 2), (items[1].id, 1)])
+    storage.snapshot()
+    storage.patch_item(items[0].id, PatchItemInfo(name="renamed", price=5.0))
+    storage.delete_item(items[1].id)
+    storage.compact()
+    storage.snapshot()
+    storage.delete_item(items[1].id)
+    other = storage.create_cart()
+    storage.add_item_to_cart(other.id, items[2].id)
+    expected_items = storage.get_items(0, 10, None, None, True)
+    expected_carts = storage.get_carts(0, 10, None, None, None, None)
+    storage.close()
+
+    # a record torn by a crash was never acknowledged and is dropped
+    logs = sorted((tmp_path / "data").glob("*.log"))
+    with open(logs[-1], "ab") as log:
+        log.write(b'["delete",')
+
+    recovered = MemoryStorage.recover(path)
+    assert recovered.get_items(0, 10, None, None, True) == expected_items
+    assert recovered.get_carts(0, 10, None, None, None, None) == expected_carts
+    assert recovered.create_item(ItemInfo(name="new", price=1.0)).id not in [item.id for item in items]
+    recovered.close()
+
+
+def test_memory_storage_keeps_writes_logged_during_a_snapshot(monkeypatch, tmp_path) -> None:
+    path = str(tmp_path / "data")
+    storage = MemoryStorage.recover(path)
+    item = storage.create_item(ItemInfo(name="item", price=1.0))
+
+    fsync = memory.os.fsync
+    def slow_fsync(fd: int) -> None:
+        time.sleep(0.2)
+        fsync(fd)
+    monkeypatch.setattr(memory.os, "fsync", slow_fsync)
+
+    # the flusher is inside the fsync of this patch while the snapshot rotates the log,
+    # and the next patch is queued after the rotation but before the flusher gets to it
+    patch = threading.Thread(target=storage.patch_item, args=(item.id, PatchItemInfo(price=2.0)))
+    patch.start()
+    time.sleep(0.05)
+    snapshot = threading.Thread(target=storage.snapshot)
+    snapshot.start()
+    time.sleep(0.05)
+    storage.patch_item(item.id, PatchItemInfo(price=3.0))
+    patch.join()
+    snapshot.join()
+    storage.close()
+    monkeypatch.undo()
+
+    recovered = MemoryStorage.recover(path)
+    assert recovered.get_item(item.id).price == 3.0
+    recovered.close()
+
+
+@pytest.mark.asyncio
+async def test_aio_offloads_blocking_calls(tmp_path) -> None:
+    threads = []
+
+    class Recording(SQLiteStorage):
+        def get_item(self, id: int) -> ItemEntity:
+            threads.append(threading.current_thread().name)
+            return super().get_item(id)
+
+    previous = get_storage()
+    sqlite = Recording(str(tmp_path / "shop.db"))
+    item = sqlite.create_item(ItemInfo(name="item", price=1.0))
+    try:
+        set_storage(sqlite)
+        assert await aio.get_item(item.id) == item
+        aio.set_offload_threads(0)
+        assert await aio.get_item(item.id) == item
+        assert threads[0].startswith("storage") and threads[1] == threading.current_thread().name
+
+        set_storage(MemoryStorage())
+        aio.set_offload_threads(2)
+        created = await aio.create_item(ItemInfo(name="item", price=1.0))
+        assert await aio.get_items(0, 10, None, None, False, query="item") == [created]
+    finally:
+        aio.set_offload_threads(8)
+        set_storage(previous)